@@ -0,0 +1,18 @@
+"""
+ASGI entry point, e.g. ``uvicorn asgi:application --workers 3``
+
+Service options are read from the DATASET_SERVICE_ARGS environment
+variable, as for wsgi.py. The handlers and the database layer stay
+synchronous (SQLAlchemy 1.3 has no asyncio support): each request runs
+in a pool of --server-threads threads, with its own database session,
+so a slow search no longer holds up the requests arriving after it.
+"""
+
+import os
+import shlex
+
+from candig_dataset_service.__main__ import application, asgi_application, main
+
+main(shlex.split(os.environ.get('DATASET_SERVICE_ARGS', '')))
+
+application = asgi_application(application.config['SERVER_THREADS'])
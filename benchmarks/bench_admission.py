@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Latency of cheap requests while a batch job floods the search endpoint,
+with the x-concurrency limits of the API spec on and off
+
+The service runs with --server asgi on a database of --rows datasets.
+--clients threads search all datasets for --seconds, while another
+thread measures the latency of getVersions. Without limits the searches
+take every server thread; with them, searches beyond the limit queue or
+are refused with 503, leaving threads for other requests.
+
+Usage::
+
+    python benchmarks/bench_admission.py --rows 2000 --clients 32 --server-threads 8
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(__file__))
+
+# pylint: disable=wrong-import-position
+from bench_response_validation import populate
+from bench_server_concurrency import get, wait_until_up
+from candig_dataset_service import orm
+
+
+def run(base, clients, seconds):
+    """
+    Searches served and refused per second, and getVersions latencies (ms)
+    """
+    stop = time.monotonic() + seconds
+    served = []
+    refused = []
+    latencies = []
+
+    def search():
+        ok = busy = 0
+        while time.monotonic() < stop:
+            try:
+                get(base + '/datasets/search')
+                ok += 1
+            except urllib.error.HTTPError as e:
+                if e.code != 503:
+                    raise
+                busy += 1
+                time.sleep(int(e.headers.get('Retry-After', 1)) / 10)
+        served.append(ok)
+        refused.append(busy)
+
+    def probe():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            get(base + '/datasets/getVersions')
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=search) for _ in range(clients)] + [threading.Thread(target=probe)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return (sum(served) / seconds, sum(refused) / seconds,
+            latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)])
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Admission control benchmark')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--server-threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8872)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        orm.init_db(uri)
+        populate(args.rows)
+        orm.dispose_engines()
+
+        for limits in ('off', 'on'):
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'candig_dataset_service', '--server', 'asgi',
+                 '--server-threads', str(args.server_threads), '--concurrency-limits', limits,
+                 '--port', str(args.port), '--database-uri', uri,
+                 '--pool-size', str(args.server_threads), '--response-validation', 'off',
+                 '--logfile', os.path.join(tmp, limits + '.log')],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            base = 'http://127.0.0.1:{}/v2'.format(args.port)
+            try:
+                wait_until_up(base + '/datasets/getVersions', process)
+                served, refused, median, p95 = run(base, args.clients, args.seconds)
+            finally:
+                process.terminate()
+                process.wait()
+            print('limits {:<3} {:>6.1f} searches/s served, {:>6.1f}/s refused, {} clients; '
+                  'getVersions p50 {:.1f}ms p95 {:.1f}ms'.format(
+                      limits, served, refused, args.clients, median, p95))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+Size and server time of a search returning every dataset, by response
+encoding
+
+Searches are served through the Flask test client, so the timings
+include compression but no network.
+
+Usage::
+
+    python benchmarks/bench_compression.py --rows 1000 --requests 20
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(__file__))
+
+# pylint: disable=wrong-import-position
+from bench_response_validation import populate
+from candig_dataset_service import orm
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.api.compression import AVAILABLE_ENCODINGS
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Response compression benchmark')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with app.app.app_context():
+            orm.init_db('sqlite:///' + os.path.join(tmp, 'bench.db'))
+            populate(args.rows)
+
+        app.app.config['RESPONSE_VALIDATION'] = 'off'
+        client = app.app.test_client()
+
+        for encoding in ('identity',) + AVAILABLE_ENCODINGS:
+            headers = {'Authorization': 'bench', 'Accept-Encoding': encoding}
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                response = client.get('/v2/datasets/search', headers=headers)
+            elapsed = (time.perf_counter() - start) / args.requests
+            print('{:<9} {:>9} bytes  {:>7.1f}ms per search of {} datasets'.format(
+                encoding, len(response.data), elapsed * 1000, args.rows))
+
+        orm.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+Primary key index size and get-by-id latency for the two SQLite GUID
+storages: 16-byte binary and 32-character hex
+
+Usage::
+
+    python benchmarks/bench_guid_storage.py --rows 1000000 --lookups 20000
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from candig_dataset_service import orm  # pylint: disable=wrong-import-position
+from candig_dataset_service.orm.models import Dataset  # pylint: disable=wrong-import-position
+
+
+def populate(uri, storage, rows, batch=50000):
+    """Create the database with the given number of datasets"""
+    orm.init_db(uri, guid_storage=storage)
+    ids = [uuid.uuid4().hex for _ in range(rows)]
+    with orm.get_engine().begin() as conn:
+        for start in range(0, rows, batch):
+            conn.execute(Dataset.__table__.insert(), [
+                {'id': iid, 'name': 'dataset_{}'.format(start + i), 'tags': ['bench'],
+                 'version': '0.1', 'ontologies': [], 'ontologies_internal': {}}
+                for i, iid in enumerate(ids[start:start + batch])])
+    orm.get_engine().execute('VACUUM')
+    return ids
+
+
+def index_size(engine):
+    """Bytes used by the primary key index, if SQLite was built with dbstat"""
+    index = engine.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                           "AND tbl_name = 'datasets' AND name LIKE 'sqlite_autoindex%'").scalar()
+    try:
+        return engine.execute('SELECT sum(pgsize) FROM dbstat WHERE name = ?', index).scalar()
+    except orm.ORMException:
+        return None
+
+
+def lookups(ids, count):
+    """Latencies of fetching random datasets by id through the ORM"""
+    db_session = orm.get_session()
+    latencies = []
+    for iid in random.sample(ids, min(count, len(ids))):
+        start = time.perf_counter()
+        db_session.query(Dataset).get(iid)
+        db_session.commit()
+        latencies.append(time.perf_counter() - start)
+        db_session.expunge_all()
+    orm.close_session()
+    latencies.sort()
+    return latencies
+
+
+def run(storage, args):
+    """Benchmark one storage"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        uri = 'sqlite:///' + path
+        ids = populate(uri, storage, args.rows)
+        orm.init_db(uri, pool_size=1)
+        latencies = lookups(ids, args.lookups)
+        size = index_size(orm.get_engine())
+        file_size = os.path.getsize(path)
+        orm.get_engine().dispose()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e6
+
+    print('{:<7} file {:>7.1f}MB  pk index {:>9}  p50 {:>6.1f}us  p99 {:>6.1f}us'.format(
+        storage, file_size / 2 ** 20,
+        '{:.1f}MB'.format(size / 2 ** 20) if size else 'n/a', pct(0.5), pct(0.99)))
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('GUID storage benchmark')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    for storage in ('hex', 'binary'):
+        run(storage, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Serialization time of a 5000-dataset search response: connexion's
+encoder as used before (stdlib json, indent=2) against dumps() with the
+stdlib and with orjson, for datasets as the search returns them (ids and
+dates already strings) and with native UUID and datetime values
+
+Usage::
+
+    python benchmarks/bench_json.py --datasets 5000 --repeat 5
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import datetime
+
+from connexion.jsonifier import JSONEncoder
+
+sys.path.append(os.getcwd())
+
+# pylint: disable=wrong-import-position
+from candig_dataset_service.api import serialization
+from candig_dataset_service.orm.serializers import dataset_serializer
+
+ONTOLOGIES = [{'id': 'DUO:00000{}'.format(i), 'name': 'term {}'.format(i), 'shorthand': 'T{}'.format(i),
+               'definition': 'This data use modifier indicates that use is limited to ' * 4}
+              for i in (12, 18, 19)]
+
+
+def dataset(i, now):
+    """A dataset with native id and dates, as a post returns it"""
+    return {'id': uuid.uuid4(), 'name': 'dataset_{}'.format(i), 'version': '0.1',
+            'tags': ['bench', str(i % 10)], 'description': 'benchmark dataset',
+            'ontologies': ONTOLOGIES, 'created': now, 'updated': now, 'revision': 1}
+
+
+def timed(func, value, repeat):
+    """Best time of repeated calls"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(value)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('JSON serialization benchmark')
+    parser.add_argument('--datasets', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    now = datetime.datetime.utcnow()
+    native = [dataset(i, now) for i in range(args.datasets)]
+    searched = [dataset_serializer.from_mapping(value) for value in native]
+
+    orjson = serialization.orjson
+    for name, values in (('search', searched), ('native', native)):
+        results = [('connexion indent=2', timed(lambda v: json.dumps(v, cls=JSONEncoder, indent=2),
+                                                values, args.repeat))]
+        serialization.orjson = None
+        results.append(('dumps, stdlib', timed(serialization.dumps, values, args.repeat)))
+        serialization.orjson = orjson
+        if orjson is not None:
+            results.append(('dumps, orjson', timed(serialization.dumps, values, args.repeat)))
+        for label, elapsed in results:
+            print('{:<7} {:<19} {:>7.1f}ms for {} datasets'.format(name, label, elapsed * 1000,
+                                                                  args.datasets))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""
+Time apilog adds to each API call, by logging setup
+
+A no-op handler decorated with apilog is called in the context of a
+request with a large ingest body (--body-kb of tags), writing to a log
+file, with:
+
+- logging off (WARN level)
+- apilog as it was: whole body and all headers, written to the file on
+  the request thread
+- the defaults (body truncated to 1 KiB, allowlisted headers), written
+  on the request thread
+- the defaults, written by the BackgroundHandler listener thread
+- the defaults with 10% of calls sampled
+
+--write-delay-ms adds a delay to each write to the file, standing in
+for a slow or network disk.
+
+Usage::
+
+    python benchmarks/bench_logging.py --calls 2000 --body-kb 64 --write-delay-ms 1
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import tempfile
+
+from decorator import decorator
+from flask import request
+from flask.logging import default_handler
+
+sys.path.append(os.getcwd())
+
+# pylint: disable=wrong-import-position
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.api.logging import apilog, BackgroundHandler, DEFAULT_LOG_HEADERS
+from candig_dataset_service.api.serialization import dumps
+
+
+@decorator
+def previous_apilog(func, *args, **kwargs):
+    """apilog before sampling, truncation and header allowlists"""
+    entrydict = {"timestamp": str(datetime.datetime.now())}
+    entrydict['method'] = request.method
+    entrydict['path'] = request.full_path
+    entrydict['data'] = str(request.data)
+    entrydict['address'] = request.remote_addr
+    entrydict['headers'] = str(request.headers)
+    app.app.logger.info(dumps(entrydict, default=str))
+    return func(*args, **kwargs)
+
+
+class SlowFileHandler(logging.FileHandler):
+    """FileHandler taking delay seconds more for each record"""
+
+    def __init__(self, filename, delay):
+        super().__init__(filename)
+        self.write_delay = delay
+
+    def emit(self, record):
+        time.sleep(self.write_delay)
+        super().emit(record)
+
+
+def post_dataset(body):
+    """Stand-in handler"""
+    return body, 201
+
+
+SETUPS = [
+    ('off', apilog, logging.WARN, False, {}),
+    ('previous apilog, sync', previous_apilog, logging.INFO, False, {}),
+    ('defaults, sync', apilog, logging.INFO, False, {}),
+    ('defaults, queued', apilog, logging.INFO, True, {}),
+    ('10% sampled, queued', apilog, logging.INFO, True, {'LOG_SAMPLE_RATE': 10}),
+]
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Request logging benchmark')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--body-kb', type=int, default=64)
+    parser.add_argument('--write-delay-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    body = json.dumps({'name': 'bench', 'tags': ['t' * 1022] * args.body_kb})
+    headers = {'Authorization': 'bench', 'User-Agent': 'bench', 'Content-Type': 'application/json'}
+    app.app.logger.removeHandler(default_handler)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, log_decorator, level, queued, config in SETUPS:
+            file_handler = SlowFileHandler(os.path.join(tmp, 'bench.log'), args.write_delay_ms / 1000)
+            handler = BackgroundHandler(file_handler) if queued else file_handler
+            app.app.logger.addHandler(handler)
+            app.app.logger.setLevel(level)
+            app.app.config.update({'LOG_BODY_BYTES': 1024, 'LOG_SAMPLE_RATE': 100,
+                                   'LOG_HEADERS': list(DEFAULT_LOG_HEADERS)}, **config)
+            handler_func = log_decorator(post_dataset)
+
+            with app.app.test_request_context('/v2/datasets', method='POST', data=body, headers=headers):
+                start = time.perf_counter()
+                for _ in range(args.calls):
+                    handler_func({})
+                elapsed = (time.perf_counter() - start) / args.calls
+
+            app.app.logger.removeHandler(handler)
+            handler.close()
+            print('{:<22} {:>8.1f}us per call with a {} KiB body'.format(name, elapsed * 1e6, args.body_kb))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""
+Resolving a list of dataset ids: one GET /datasets/{id} per id, against
+one POST /datasets/lookup for all of them
+
+Requests are served through the Flask test client, so the timings
+include routing, validation and serialization but no network; over a
+network each of the single gets would also pay a round trip.
+
+Usage::
+
+    python benchmarks/bench_multi_get.py --rows 5000 --ids 500
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import tempfile
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(__file__))
+
+# pylint: disable=wrong-import-position
+from bench_response_validation import populate
+from candig_dataset_service import orm
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.orm.models import Dataset
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Multi-get benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--ids', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with app.app.app_context():
+            orm.init_db('sqlite:///' + os.path.join(tmp, 'bench.db'))
+            populate(args.rows)
+            ids = [uuid.UUID(str(row.id)).hex for row in orm.get_session().query(Dataset.id)]
+        ids = random.sample(ids, args.ids)
+
+        client = app.app.test_client()
+        headers = {'Authorization': 'bench'}
+        app.app.config['RESPONSE_VALIDATION'] = 'off'
+
+        start = time.perf_counter()
+        for dataset_id in ids:
+            assert client.get('/v2/datasets/' + dataset_id, headers=headers).status_code == 200
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = client.post('/v2/datasets/lookup', json={'ids': ids}, headers=headers)
+        lookup = time.perf_counter() - start
+        assert len(response.json['datasets']) == args.ids
+
+        print('{} gets  {:>8.1f}ms'.format(args.ids, single * 1000))
+        print('1 lookup  {:>8.1f}ms for {} ids of {} datasets'.format(lookup * 1000, args.ids, args.rows))
+
+        orm.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
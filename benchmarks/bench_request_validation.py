@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""
+Per-body cost of validating POST /datasets requests: connexion's
+jsonschema validator against the compiled validator, and the DUO term
+expansion done by post_dataset with and without its term cache
+
+Usage::
+
+    python benchmarks/bench_request_validation.py --bodies 20000
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+
+import yaml
+from connexion.json_schema import resolve_refs, Draft4RequestValidator
+
+sys.path.append(os.getcwd())
+
+# pylint: disable=wrong-import-position
+from candig_dataset_service.api import operations
+from candig_dataset_service.api.validation import compile_schema, FORMAT_CHECKER
+from candig_dataset_service.ontologies.duo import OntologyParser, ont
+
+SPEC = os.path.join(os.path.dirname(operations.__file__), 'datasets.yaml')
+
+
+def body(i):
+    """A dataset_ingest body with DUO terms"""
+    return {'id': uuid.uuid4().hex, 'name': 'dataset_{}'.format(i), 'version': '0.1',
+            'description': 'benchmark dataset', 'tags': ['bench', str(i % 10), 'candig'],
+            'ontologies': [{'id': 'duo', 'terms': [{'id': 'DUO:0000018'}, {'id': 'DUO:0000012'},
+                                                   {'id': 'DUO:0000007'}]}]}
+
+
+def per_body(func, bodies):
+    """Mean microseconds of func over the bodies"""
+    start = time.perf_counter()
+    for item in bodies:
+        func(item)
+    return (time.perf_counter() - start) / len(bodies) * 1e6
+
+
+def expand_uncached(item):
+    """DUO expansion as post_dataset did it before the term cache"""
+    for term in item['ontologies'][0]['terms']:
+        OntologyParser(ont, term['id']).get_overview()
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Request validation benchmark')
+    parser.add_argument('--bodies', type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(SPEC) as spec_file:
+        schema = resolve_refs(yaml.safe_load(spec_file))['components']['schemas']['dataset_ingest']
+    bodies = [body(i) for i in range(args.bodies)]
+
+    jsonschema_validator = Draft4RequestValidator(schema, format_checker=FORMAT_CHECKER)
+    compiled = compile_schema(schema)
+
+    print('jsonschema          {:>7.1f}us per body'.format(per_body(jsonschema_validator.validate, bodies)))
+    if compiled is None:
+        print('compiled            fastjsonschema is not installed')
+    else:
+        print('compiled            {:>7.1f}us per body'.format(per_body(compiled, bodies)))
+
+    print('DUO expansion       {:>7.1f}us per body'.format(per_body(expand_uncached, bodies)))
+    print('DUO expansion cache {:>7.1f}us per body'.format(per_body(
+        lambda item: [operations._duo_overview(term['id'])  # pylint: disable=protected-access
+                      for term in item['ontologies'][0]['terms']], bodies)))
+
+
+if __name__ == '__main__':
+    main()
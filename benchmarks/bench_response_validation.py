@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Cost of response validation per search request, by validation mode
+
+Searches returning every dataset are served through the Flask test
+client, so the timings include routing, serialization and validation
+but no network.
+
+Usage::
+
+    python benchmarks/bench_response_validation.py --rows 1000 --requests 20
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import datetime
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from candig_dataset_service import orm  # pylint: disable=wrong-import-position
+from candig_dataset_service.__main__ import app  # pylint: disable=wrong-import-position
+from candig_dataset_service.orm.models import Dataset  # pylint: disable=wrong-import-position
+
+# stored ontologies are expanded with the DUO names and definitions
+ONTOLOGIES = [{'id': 'DUO:00000{}'.format(i), 'name': 'term {}'.format(i), 'shorthand': 'T{}'.format(i),
+               'definition': 'This data use modifier indicates that use is limited to ' * 4}
+              for i in (12, 18, 19)]
+
+MODES = [('always', 100), ('sampled', 10), ('sampled', 1), ('off', 0)]
+
+
+def populate(rows):
+    """Fill the database with the given number of datasets"""
+    now = datetime.datetime.utcnow()
+    with orm.get_engine().begin() as conn:
+        conn.execute(Dataset.__table__.insert(), [
+            {'id': uuid.uuid4().hex, 'name': 'dataset_{}'.format(i), 'version': '0.1',
+             'tags': ['bench', str(i % 10)], 'description': 'benchmark dataset',
+             'ontologies': ONTOLOGIES, 'ontologies_internal': {'duo': []}, 'created': now}
+            for i in range(rows)])
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Response validation benchmark')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with app.app.app_context():
+            orm.init_db('sqlite:///' + os.path.join(tmp, 'bench.db'))
+            populate(args.rows)
+
+        client = app.app.test_client()
+        headers = {'Authorization': 'bench'}
+        client.get('/v2/datasets/search', headers=headers)
+
+        for mode, rate in MODES:
+            app.app.config['RESPONSE_VALIDATION'] = mode
+            app.app.config['RESPONSE_VALIDATION_SAMPLE'] = rate
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                assert client.get('/v2/datasets/search', headers=headers).status_code == 200
+            elapsed = (time.perf_counter() - start) / args.requests
+            print('{:<8} {:>4}%  {:>8.1f}ms per search of {} datasets'.format(
+                mode, rate, elapsed * 1000, args.rows))
+
+        orm.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
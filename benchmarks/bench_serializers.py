@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""
+Serialization throughput of search results: orm.dump() on hydrated
+Dataset objects against the compiled serializer on result tuples
+
+Usage::
+
+    python benchmarks/bench_serializers.py --rows 10000 --repeat 5
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import datetime
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from candig_dataset_service import orm  # pylint: disable=wrong-import-position
+from candig_dataset_service.orm.models import Dataset  # pylint: disable=wrong-import-position
+from candig_dataset_service.orm.serializers import dataset_serializer  # pylint: disable=wrong-import-position
+
+ONTOLOGIES = [{'id': 'duo', 'terms': [{'id': 'DUO:0000018', 'label': 'not for profit use only'},
+                                      {'id': 'DUO:0000012', 'label': 'research specific'}]}]
+
+
+def populate(rows):
+    """Fill the database with the given number of datasets"""
+    now = datetime.datetime.utcnow()
+    with orm.get_engine().begin() as conn:
+        conn.execute(Dataset.__table__.insert(), [
+            {'id': uuid.uuid4().hex, 'name': 'dataset_{}'.format(i), 'version': '0.1',
+             'tags': ['bench', str(i % 10)], 'description': 'benchmark dataset',
+             'ontologies': ONTOLOGIES, 'ontologies_internal': {'duo': []}, 'created': now}
+            for i in range(rows)])
+
+
+def with_dump(db_session):
+    """Search as before: hydrate Dataset objects, then dump()"""
+    return [orm.dump(dataset) for dataset in db_session.query(Dataset)]
+
+
+def with_serializer(db_session):
+    """Search selecting the serialized columns only"""
+    return [dataset_serializer(row) for row in db_session.query(*dataset_serializer.columns)]
+
+
+def timed(func, repeat):
+    """Best wall time of repeated searches, each in a fresh session"""
+    best = float('inf')
+    for _ in range(repeat):
+        db_session = orm.get_session()
+        start = time.perf_counter()
+        func(db_session)
+        best = min(best, time.perf_counter() - start)
+        orm.close_session()
+        db_session.remove()
+    return best
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Serializer benchmark')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        orm.init_db('sqlite:///' + os.path.join(tmp, 'bench.db'))
+        populate(args.rows)
+
+        for name, func in (('dump', with_dump), ('serializer', with_serializer)):
+            elapsed = timed(func, args.repeat)
+            print('{:<11} {:>9.0f} rows/s  ({:.1f}ms for {} rows, query included)'.format(
+                name, args.rows / elapsed, elapsed * 1000, args.rows))
+
+        db_session = orm.get_session()
+        rows = db_session.query(*dataset_serializer.columns).all()
+        start = time.perf_counter()
+        for row in rows:
+            dataset_serializer(row)
+        elapsed = time.perf_counter() - start
+        print('{:<11} {:>9.0f} rows/s  (serialization only)'.format('serializer', len(rows) / elapsed))
+        orm.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
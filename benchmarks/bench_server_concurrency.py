@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Concurrent search throughput by server mode (--server tornado or asgi)
+
+Each mode is started as a separate process on a database of --rows
+datasets. --clients threads then search all datasets for --seconds and
+--long-polls threads wait on the change feed, while another thread
+measures the latency of a cheap request (getVersions) queued behind
+them. Searches are CPU bound and share the GIL in either mode; waits on
+the database or the change feed only hold up other requests on tornado.
+
+Usage::
+
+    python benchmarks/bench_server_concurrency.py --rows 1000 --clients 8 --long-polls 2
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(__file__))
+
+# pylint: disable=wrong-import-position
+from bench_response_validation import populate
+from candig_dataset_service import orm
+
+HEADERS = {'Authorization': 'bench'}
+
+
+def get(url):
+    """GET a URL, returning the status code"""
+    with urllib.request.urlopen(urllib.request.Request(url, headers=HEADERS), timeout=60) as response:
+        response.read()
+        return response.status
+
+
+def wait_until_up(url, process, timeout=60):
+    """Wait for the server to answer"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited with code {}'.format(process.returncode))
+        try:
+            get(url)
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def run(base, clients, long_polls, seconds):
+    """
+    Searches per second and cheap request latencies (ms) under load
+    """
+    stop = time.monotonic() + seconds
+    searches = []
+    latencies = []
+
+    def search():
+        count = 0
+        while time.monotonic() < stop:
+            get(base + '/datasets/search')
+            count += 1
+        searches.append(count)
+
+    def long_poll():
+        while time.monotonic() < stop:
+            get(base + '/datasets/changes?since=1000000000&timeout=1')
+
+    def probe():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            get(base + '/datasets/getVersions')
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=search) for _ in range(clients)] + \
+        [threading.Thread(target=long_poll) for _ in range(long_polls)] + [threading.Thread(target=probe)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return sum(searches) / seconds, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Server concurrency benchmark')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--long-polls', type=int, default=0)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8871)
+    parser.add_argument('--database-uri', help='Benchmark another database, e.g. postgresql://...')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = args.database_uri or 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        orm.init_db(uri)
+        populate(args.rows)
+        orm.dispose_engines()
+
+        for server in ('tornado', 'asgi'):
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'candig_dataset_service', '--server', server,
+                 '--port', str(args.port), '--database-uri', uri, '--pool-size', str(args.clients),
+                 '--response-validation', 'off', '--logfile', os.path.join(tmp, server + '.log')],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            base = 'http://127.0.0.1:{}/v2'.format(args.port)
+            try:
+                wait_until_up(base + '/datasets/getVersions', process)
+                throughput, median, p95 = run(base, args.clients, args.long_polls, args.seconds)
+            finally:
+                process.terminate()
+                process.wait()
+            print('{:<8} {:>6.1f} searches/s of {} datasets, {} clients, {} long-polls; '
+                  'getVersions p50 {:.1f}ms p95 {:.1f}ms'.format(
+                      server, throughput, args.rows, args.clients, args.long_polls, median, p95))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Read latency under concurrent writes, for different SQLite storage settings
+
+A writer process inserts datasets in a loop (like a uwsgi worker serving
+POSTs) while reader threads fetch datasets by id. Reported latencies are
+per get-by-id, measured in the readers.
+
+Usage::
+
+    python benchmarks/bench_sqlite_concurrency.py --rows 10000 --seconds 10
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.append(os.getcwd())
+
+from candig_dataset_service import orm  # pylint: disable=wrong-import-position
+from candig_dataset_service.orm.models import Dataset  # pylint: disable=wrong-import-position
+
+CONFIGS = {
+    'default': {},
+    'wal': {
+        'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000},
+    },
+    'wal+pool': {
+        'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000,
+                    'cache_size': -65536, 'mmap_size': 268435456},
+        'pool_size': 8,
+    },
+}
+
+
+def populate(uri, rows):
+    """Create the database with the given number of datasets"""
+    orm.init_db(uri)
+    db_session = orm.get_session()
+    ids = [uuid.uuid4().hex for _ in range(rows)]
+    db_session.bulk_save_objects([
+        Dataset(id=iid, name='dataset_{}'.format(i), tags=['bench', str(i % 10)], version='0.1',
+                ontologies=[], ontologies_internal={})
+        for i, iid in enumerate(ids)])
+    db_session.commit()
+    orm.close_session()
+    return ids
+
+
+def write_loop(uri, config, stop):
+    """Insert one dataset per transaction until stopped"""
+    orm.init_db(uri, **config)
+    db_session = orm.get_session()
+    i = 0
+    while not stop.is_set():
+        db_session.add(Dataset(id=uuid.uuid4().hex, name='written_{}_{}'.format(os.getpid(), i),
+                               tags=[], ontologies=[], ontologies_internal={}))
+        try:
+            db_session.commit()
+        except orm.ORMException:
+            db_session.rollback()
+        i += 1
+
+
+def read_loop(ids, deadline, latencies, errors):
+    """Fetch random datasets by id until the deadline"""
+    db_session = orm.get_session()
+    i = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            db_session.query(Dataset).get(ids[i % len(ids)])
+            db_session.commit()
+            latencies.append(time.perf_counter() - start)
+        except orm.ORMException:
+            db_session.rollback()
+            errors.append(1)
+        db_session.expunge_all()
+        i += 7919
+    orm.get_session().remove()
+
+
+def run(name, config, args):
+    """Benchmark one configuration"""
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        ids = populate(uri, args.rows)
+        orm.init_db(uri, **config)
+
+        stop = multiprocessing.Event()
+        writers = [multiprocessing.Process(target=write_loop, args=(uri, config, stop))
+                   for _ in range(args.writers)]
+        for writer in writers:
+            writer.start()
+
+        latencies, errors = [], []
+        deadline = time.monotonic() + args.seconds
+        readers = [threading.Thread(target=read_loop, args=(ids, deadline, latencies, errors))
+                   for _ in range(args.readers)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+
+        stop.set()
+        for writer in writers:
+            writer.join()
+        orm.get_engine().dispose()
+
+    latencies.sort()
+    count = len(latencies)
+
+    def pct(p):
+        return latencies[min(count - 1, int(count * p))] * 1000 if count else float('nan')
+
+    print('{:<10} reads/s {:>8.0f}  p50 {:>7.2f}ms  p95 {:>7.2f}ms  p99 {:>7.2f}ms  errors {}'.format(
+        name, count / args.seconds, pct(0.5), pct(0.95), pct(0.99), len(errors)))
+
+
+def main():
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('SQLite concurrency benchmark')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--config', choices=list(CONFIGS), nargs='*', default=list(CONFIGS))
+    args = parser.parse_args()
+
+    for name in args.config:
+        run(name, CONFIGS[name], args)
+
+
+if __name__ == '__main__':
+    main()
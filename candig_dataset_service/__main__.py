@@ -11,10 +11,37 @@ import logging
 
 import connexion
 import pkg_resources
+from flask.logging import default_handler
 from prometheus_flask_exporter import PrometheusMetrics
+from candig_dataset_service.api.admission import AdmissionResolver
+from candig_dataset_service.api.instrumentation import InstrumentingResolver, add_server_timing
+from candig_dataset_service.api.logging import BackgroundHandler, DEFAULT_LOG_HEADERS
+from candig_dataset_service.api.profiling import ProfilingResolver, add_profile_id
+from candig_dataset_service.api.compression import compress_response, AVAILABLE_ENCODINGS
+from candig_dataset_service.api.serialization import install_json_encoder
+from candig_dataset_service.api.validation import CompiledRequestBodyValidator, \
+    SampledResponseValidator, RESPONSE_VALIDATION_MODES, DEFAULT_RESPONSE_VALIDATION
 
 from tornado.options import define
+from werkzeug.wsgi import ClosingIterator
 import candig_dataset_service.orm
+from candig_dataset_service.orm.instrumentation import SLOW_QUERIES
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    WSGIMiddleware = None
+
+
+def _sample_rate(value):
+    """
+    Parse a HANDLER=RATE log sampling option
+    """
+    name, _, rate = value.partition('=')
+    try:
+        return name, float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected HANDLER=RATE, e.g. search_datasets=10')
 
 
 def main(args=None):
@@ -28,32 +55,174 @@ def main(args=None):
     parser.add_argument('--port', default=8870)
     parser.add_argument('--host', default='ga4ghdev01.bcgsc.ca')
     parser.add_argument('--database', default='./data/datasets.db')
+    parser.add_argument('--database-uri',
+                        help='Database URI, e.g. postgresql://..., overrides --database')
     parser.add_argument('--logfile', default="./log/datasets.log")
     parser.add_argument('--loglevel', default='INFO',
                         choices=['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'])
+    parser.add_argument('--log-sample-rate', type=float, default=100,
+                        help='Percentage of API calls logged')
+    parser.add_argument('--log-sample-rates', nargs='*', type=_sample_rate, default=[],
+                        metavar='HANDLER=RATE',
+                        help='Percentage of calls logged for given handlers, overriding '
+                             '--log-sample-rate, e.g. search_datasets=10')
+    parser.add_argument('--log-body-bytes', type=int, default=1024,
+                        help='Bytes of request bodies logged (0: none, -1: all)')
+    parser.add_argument('--log-headers', nargs='*', default=list(DEFAULT_LOG_HEADERS),
+                        help='Request headers logged')
     parser.add_argument('--name', default="candig_service")
+    parser.add_argument('--admin-keys', nargs='*', default=[],
+                        help='API keys allowed to call admin endpoints (default: none)')
+    parser.add_argument('--server', choices=['tornado', 'asgi'], default='tornado',
+                        help='Serve requests one at a time on the tornado IOLoop, or with '
+                             'uvicorn, running them in a pool of --server-threads threads')
+    parser.add_argument('--server-threads', type=int, default=8,
+                        help='Requests handled concurrently by the asgi server and asgi.py')
+    parser.add_argument('--concurrency-limits', choices=['on', 'off'], default='on',
+                        help='Apply the x-concurrency limits of the API spec, refusing '
+                             'requests with 503 when an operation\'s queue is full')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='Requests per second allowed to each API key, refused with 429 '
+                             'beyond it (default: 0, no limit)')
+    parser.add_argument('--rate-limit-burst', type=int,
+                        help='Requests an API key may make at once before --rate-limit '
+                             'applies (default: one second\'s worth)')
+    parser.add_argument('--write-batch-ms', type=float, default=0,
+                        help='Group inserts arriving within this many milliseconds into '
+                             'one transaction (default: 0, commit each insert directly)')
+    parser.add_argument('--idempotency-ttl', type=int, default=86400,
+                        help='Seconds to keep responses for Idempotency-Key retries')
+
+    # Storage tuning
+    parser.add_argument('--journal-mode', choices=['DELETE', 'TRUNCATE', 'PERSIST', 'WAL'],
+                        help='SQLite journal mode; WAL lets reads proceed during writes')
+    parser.add_argument('--synchronous', choices=['OFF', 'NORMAL', 'FULL', 'EXTRA'],
+                        help='SQLite synchronous setting; NORMAL is durable enough with WAL')
+    parser.add_argument('--cache-size', type=int,
+                        help='SQLite page cache per connection (pages, or KiB if negative)')
+    parser.add_argument('--mmap-size', type=int,
+                        help='Bytes of the SQLite database file to memory-map')
+    parser.add_argument('--busy-timeout', type=int,
+                        help='Milliseconds SQLite waits on a locked database before failing')
+    parser.add_argument('--pool-size', type=int,
+                        help='Number of pooled DB connections kept open per process')
+    parser.add_argument('--pool-recycle', type=int, default=-1,
+                        help='Seconds after which pooled connections are replaced')
+    parser.add_argument('--pool-pre-ping', action='store_true',
+                        help='Test pooled connections for liveness on checkout')
+    parser.add_argument('--read-only', action='store_true',
+                        help='Open the database read-only, for workers that only serve reads')
+    parser.add_argument('--guid-storage', choices=['binary', 'hex'], default='binary',
+                        help='How to store dataset ids in a new SQLite database; existing '
+                             'databases are converted with the admin migrate-guid command')
+    parser.add_argument('--replica-uri', action='append', default=[],
+                        help='URI of a read replica, or of a read-only copy of the SQLite '
+                             'database, serving reads; may be given several times')
+    parser.add_argument('--read-your-writes', type=float, default=5,
+                        help='Seconds after a write during which the same client reads '
+                             'from the primary rather than the replicas')
+    parser.add_argument('--cache-max-age', type=int, default=0,
+                        help='Seconds HTTP caches may serve dataset, search and change log '
+                             'reads without revalidating them (default: 0, always revalidate)')
+    parser.add_argument('--compress-encodings', nargs='*', choices=['br', 'zstd', 'gzip'],
+                        default=list(AVAILABLE_ENCODINGS),
+                        help='Response encodings offered to clients, most preferred first; '
+                             'none disables compression (default: those installed)')
+    parser.add_argument('--compress-min-size', type=int, default=1024,
+                        help='Bytes below which responses are sent uncompressed')
+    parser.add_argument('--compress-level', type=int,
+                        help='Compression level (default: 6 for gzip, 4 for br, 3 for zstd)')
+    parser.add_argument('--slow-query-ms', type=float, default=500,
+                        help='Log the database statements taking this long or more, with '
+                             'their plan, and list them at /datasets/admin/slow-queries; 0 disables')
+    parser.add_argument('--profile-limit', type=float, default=0,
+                        help='Requests per minute that admin keys may have profiled with an '
+                             'X-Profile: true header, per process (default: 0, disabled)')
+    parser.add_argument('--profile-dir', default='./log/profiles',
+                        help='Directory where the profiles of requests are written')
+    parser.add_argument('--response-validation', choices=RESPONSE_VALIDATION_MODES,
+                        default=DEFAULT_RESPONSE_VALIDATION,
+                        help='Validate every response against the API spec (always), a '
+                             'sample of them, logging violations (sampled), or none (off)')
+    parser.add_argument('--response-sample-rate', type=float, default=1,
+                        help='Percentage of responses validated in sampled mode')
+    parser.add_argument('--json-codec', choices=['auto', 'json', 'orjson', 'msgpack'],
+                        default='auto',
+                        help='Encoding of stored tags, ontologies and change logs; auto uses '
+                             'orjson when installed. Rows written with any codec stay readable')
 
 
 
     # known args used to supply command line args to pytest without raising an error here
-    args, _ = parser.parse_known_args()
+    args, _ = parser.parse_known_args(args)
+    if args.server == 'asgi' and WSGIMiddleware is None:
+        parser.error('--server asgi requires the a2wsgi and uvicorn packages')
 
     # Logging configuration
 
-    log_handler = logging.FileHandler(args.logfile)
+    # records are written to the file, and to stderr by flask's handler,
+    # from a listener thread, off the request path
     numeric_loglevel = getattr(logging, args.loglevel.upper())
+    app.app.logger.removeHandler(default_handler)
+    log_handler = BackgroundHandler(logging.FileHandler(args.logfile), default_handler)
     log_handler.setLevel(numeric_loglevel)
 
     app.app.logger.addHandler(log_handler)
     app.app.logger.setLevel(numeric_loglevel)
 
+    app.app.config['LOG_SAMPLE_RATE'] = args.log_sample_rate
+    app.app.config['LOG_SAMPLE_RATES'] = dict(args.log_sample_rates)
+    app.app.config['LOG_BODY_BYTES'] = None if args.log_body_bytes < 0 else args.log_body_bytes
+    app.app.config['LOG_HEADERS'] = args.log_headers
+
     app.app.config['name'] = args.name
     app.app.config["self"] = "http://{}/{}".format(args.host, args.port)
+    app.app.config['SERVER'] = args.server
+    app.app.config['SERVER_THREADS'] = args.server_threads
+    app.app.config['ADMIN_KEYS'] = args.admin_keys
+    app.app.config['CONCURRENCY_LIMITS'] = args.concurrency_limits == 'on'
+    app.app.config['RATE_LIMIT'] = args.rate_limit
+    app.app.config['RATE_LIMIT_BURST'] = args.rate_limit_burst
+    app.app.config['IDEMPOTENCY_TTL'] = args.idempotency_ttl
+    app.app.config['CACHE_MAX_AGE'] = args.cache_max_age
+    app.app.config['COMPRESS_ENCODINGS'] = args.compress_encodings
+    app.app.config['COMPRESS_MIN_SIZE'] = args.compress_min_size
+    app.app.config['COMPRESS_LEVEL'] = args.compress_level
+    app.app.config['PROFILE_LIMIT'] = args.profile_limit
+    app.app.config['PROFILE_DIR'] = args.profile_dir
+    app.app.config['RESPONSE_VALIDATION'] = args.response_validation
+    app.app.config['RESPONSE_VALIDATION_SAMPLE'] = args.response_sample_rate
 
     # set up db
 
+    pragmas = {
+        'journal_mode': args.journal_mode,
+        'synchronous': args.synchronous,
+        'cache_size': args.cache_size,
+        'mmap_size': args.mmap_size,
+        'busy_timeout': args.busy_timeout,
+    }
+    engine_options = {
+        'pool_size': args.pool_size,
+        'pool_recycle': args.pool_recycle,
+        'pool_pre_ping': args.pool_pre_ping,
+    }
+    app.app.config['DB_PRAGMAS'] = {k: v for k, v in pragmas.items() if v is not None}
+    app.app.config['DB_ENGINE_OPTIONS'] = {k: v for k, v in engine_options.items() if v is not None}
+    app.app.config['DB_READ_ONLY'] = args.read_only
+    app.app.config['READ_YOUR_WRITES'] = args.read_your_writes
+
+    SLOW_QUERIES.threshold = args.slow_query_ms / 1000
+
     define("dbfile", default=args.database)
-    candig_dataset_service.orm.init_db()
+    candig_dataset_service.orm.init_db(args.database_uri,
+                                       write_batch_window=args.write_batch_ms / 1000,
+                                       pragmas=app.app.config['DB_PRAGMAS'],
+                                       read_only=app.app.config['DB_READ_ONLY'],
+                                       guid_storage=args.guid_storage,
+                                       json_codec=args.json_codec,
+                                       replica_uris=args.replica_uri,
+                                       **app.app.config['DB_ENGINE_OPTIONS'])
     db_session = candig_dataset_service.orm.get_session()
 
     @app.app.teardown_appcontext
@@ -63,6 +232,7 @@ def main(args=None):
         """
 
         db_session.remove()
+        candig_dataset_service.orm.remove_read_session()
 
     return app, args.port
 
@@ -75,6 +245,7 @@ def configure_app():
     """
 
     app = connexion.FlaskApp(__name__, server='tornado', options={"swagger_url": "/"})
+    install_json_encoder(app.app)
 
     # api_def = pkg_resources.resource_filename('candig_dataset_service', 'api/datasets.yaml')
 
@@ -82,7 +253,20 @@ def configure_app():
 
     api_def = './api/datasets.yaml'
 
-    app.add_api(api_def, strict_validation=True, validate_responses=True)
+    # request bodies are checked by validators compiled here, once; responses
+    # are validated according to the RESPONSE_VALIDATION setting
+    # operations are wrapped with the rate limit and their x-concurrency
+    # limit, and their database queries are recorded; they are profiled
+    # when an admin asks for it
+    app.add_api(api_def, strict_validation=True, validate_responses=True,
+                resolver=InstrumentingResolver(ProfilingResolver(AdmissionResolver())),
+                validator_map={'body': CompiledRequestBodyValidator,
+                               'response': SampledResponseValidator})
+
+    # registered first so that it runs last, on the final body
+    app.app.after_request(compress_response)
+    app.app.after_request(add_server_timing)
+    app.app.after_request(add_profile_id)
 
     @app.app.after_request  # pylint:disable=unused-variable,unused-argument
     def rewrite_bad_request(response):
@@ -96,6 +280,29 @@ def configure_app():
     return app
 
 
+def asgi_application(threads=8):
+    """
+    The app as an ASGI application. Handlers and the database layer are
+    synchronous, so each request runs in a pool of threads, keeping the
+    event loop free while slow queries are running.
+
+    :param threads: number of requests handled concurrently
+    """
+    if WSGIMiddleware is None:
+        raise RuntimeError('The ASGI application requires the a2wsgi package')
+
+    def release_sessions():
+        # the pool threads outlive the request, and so would their
+        # sessions, holding a connection idle in transaction
+        candig_dataset_service.orm.get_session().remove()
+        candig_dataset_service.orm.remove_read_session()
+
+    def wsgi_app(environ, start_response):
+        return ClosingIterator(app.app(environ, start_response), release_sessions)
+
+    return WSGIMiddleware(wsgi_app, workers=threads)
+
+
 app = configure_app()
 
 # expose flask app for uwsgi
@@ -109,4 +316,11 @@ if __name__ == '__main__':
         APPLICATION.app.config["name"],
         APPLICATION.app.config["self"]
         ))
-    APPLICATION.run(port=PORT)
+    if APPLICATION.app.config['SERVER'] == 'asgi':
+        import uvicorn  # pylint: disable=import-outside-toplevel
+        uvicorn.run(asgi_application(APPLICATION.app.config['SERVER_THREADS']),
+                    host='0.0.0.0', port=int(PORT))
+    else:
+        # tornado serves one request at a time, so the change feed must not wait
+        APPLICATION.app.config['LONG_POLL'] = False
+        APPLICATION.run(port=PORT)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+Administrative command line tools for the dataset service
+
+Usage::
+
+    python -m candig_dataset_service.admin --database ./data/datasets.db \
+        delete --tags retired_study --dry-run
+
+    python -m candig_dataset_service.admin --database ./data/datasets.db \
+        export --out ./backup/datasets.ndjson.gz --since 2020-06-01T00:00:00
+
+    python -m candig_dataset_service.admin --database ./data/datasets.db \
+        migrate-guid --to binary
+"""
+
+import sys
+import json
+import argparse
+
+import candig_dataset_service.orm
+from candig_dataset_service.orm.queries import dataset_filters, delete_datasets
+from candig_dataset_service.orm.export import export_lines, gzip_stream, parse_timestamp
+
+
+def delete(args):
+    """
+    Delete every dataset matching the search filters in one statement
+    """
+    criteria = dataset_filters(tags=args.tags, version=args.version, ontologies=args.ontologies)
+    if not criteria:
+        print('At least one of --tags, --version or --ontologies is required', file=sys.stderr)
+        return 1
+
+    db_session = candig_dataset_service.orm.get_session()
+    count = delete_datasets(db_session, criteria, dry_run=args.dry_run)
+    db_session.commit()
+
+    if args.dry_run:
+        print('{} datasets match'.format(count))
+    else:
+        print('{} datasets deleted'.format(count))
+    return 0
+
+
+def export(args):
+    """
+    Write a consistent snapshot of the catalog to a gzipped NDJSON file,
+    with its manifest alongside in <out>.manifest.json
+    """
+    try:
+        since = parse_timestamp(args.since)
+    except ValueError:
+        print('--since must be an ISO 8601 date-time: ' + args.since, file=sys.stderr)
+        return 1
+    manifest = {}
+
+    with open(args.out, 'wb') as out:
+        lines = export_lines(candig_dataset_service.orm.get_engine(), since=since,
+                             manifest=manifest)
+        for chunk in gzip_stream(lines):
+            out.write(chunk)
+
+    with open(args.out + '.manifest.json', 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+
+    print('Exported {} datasets and {} change logs to {}'.format(
+        manifest['counts']['dataset'], manifest['counts']['changelog'], args.out))
+    return 0
+
+
+def migrate_guid(args):
+    """
+    Convert the stored dataset ids to another storage
+    """
+    try:
+        count = candig_dataset_service.orm.migrate_guid_storage(
+            candig_dataset_service.orm.get_engine(), args.to)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print('Converted {} ids to {} storage'.format(count, args.to))
+    return 0
+
+
+def main(args=None):
+    """
+    Main Routine
+    """
+    parser = argparse.ArgumentParser('Dataset service administration')
+    parser.add_argument('--database', default='./data/datasets.db')
+    parser.add_argument('--uri', help='Database URI, e.g. postgresql://..., overrides --database')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    delete_parser = subparsers.add_parser('delete', help='Bulk delete datasets by search filters')
+    delete_parser.add_argument('--tags', nargs='+')
+    delete_parser.add_argument('--version')
+    delete_parser.add_argument('--ontologies', nargs='+')
+    delete_parser.add_argument('--dry-run', action='store_true',
+                               help='Only report how many datasets match')
+    delete_parser.set_defaults(func=delete)
+
+    export_parser = subparsers.add_parser('export', help='Export a snapshot of the catalog')
+    export_parser.add_argument('--out', required=True, help='Path of the .ndjson.gz file to write')
+    export_parser.add_argument('--since',
+                               help='Only export records created or updated since this '
+                                    'ISO 8601 UTC date-time')
+    export_parser.set_defaults(func=export)
+
+    migrate_parser = subparsers.add_parser('migrate-guid',
+                                           help='Convert stored dataset ids between 16-byte '
+                                                'binary and 32-character hex storage')
+    migrate_parser.add_argument('--to', choices=['binary', 'hex'], default='binary')
+    migrate_parser.set_defaults(func=migrate_guid)
+
+    args = parser.parse_args(args)
+
+    candig_dataset_service.orm.init_db(args.uri or 'sqlite:///' + args.database)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
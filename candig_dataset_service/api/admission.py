@@ -0,0 +1,220 @@
+"""
+Admission control for API operations
+
+Operations declaring ``x-concurrency`` in datasets.yaml, e.g.::
+
+    x-concurrency:
+      limit: 2      # requests running at once, per process
+      queue: 2      # requests waiting for a slot, beyond which they are refused
+      timeout: 2    # seconds a request waits for a slot
+
+run at most ``limit`` at a time; a request finding the queue full, or
+still waiting after ``timeout`` seconds, is answered 503 with a
+Retry-After header. Waiting requests hold a server thread too, so
+``limit + queue`` is kept below the server's threads: a burst of
+expensive searches then cannot take every thread from cheap lookups.
+CONCURRENCY_LIMITS in the app config turns the limits off.
+
+An operation that long-polls may also declare
+``x-long-poll-concurrency``: its requests passing a non-zero ``timeout``
+are then counted against that limit instead, so that consumers waiting
+on the change feed do not take the slots of those reading it.
+
+RATE_LIMIT in the app config (requests per second, 0 for none) limits
+each API key with a token bucket holding up to RATE_LIMIT_BURST
+requests; requests over the limit are answered 429 with Retry-After.
+
+Queue depths and refused requests are exported as Prometheus metrics.
+"""
+
+import math
+import time
+import threading
+import functools
+
+import flask
+from prometheus_client import Counter, Gauge
+from connexion.resolver import Resolver, Resolution
+
+QUEUE_DEPTH = Gauge('dataset_service_admission_queue_depth',
+                    'Requests waiting for a concurrency slot of the operation',
+                    ['operation'])
+
+REJECTIONS = Counter('dataset_service_admission_rejections_total',
+                     'Requests refused by admission control',
+                     ['operation', 'reason'])
+
+# buckets left untouched long enough to be full again are dropped once
+# this many API keys are tracked
+MAX_TRACKED_KEYS = 10000
+
+
+class ConcurrencyLimit:
+    """
+    Limit on the requests of an operation running at once, with a
+    bounded queue of requests waiting for a slot
+    """
+
+    def __init__(self, operation, limit, queue=0, timeout=1):
+        """
+        :param operation: operationId, labelling the metrics
+        :param limit: requests running at once
+        :param queue: requests waiting for a slot
+        :param timeout: seconds a request waits for a slot
+        """
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._depth = QUEUE_DEPTH.labels(operation=operation)
+
+    def acquire(self):
+        """
+        Take a slot, waiting for one if the queue has room
+
+        :return: True once a slot is held, False if the queue was full or
+            none was freed in time
+        """
+        with self._condition:
+            if self._running < self.limit:
+                self._running += 1
+                return True
+            if self._waiting >= self.queue:
+                return False
+
+            self._waiting += 1
+            self._depth.inc()
+            try:
+                admitted = self._condition.wait_for(lambda: self._running < self.limit,
+                                                    self.timeout)
+            finally:
+                self._waiting -= 1
+                self._depth.dec()
+            if admitted:
+                self._running += 1
+            return admitted
+
+    def release(self):
+        """
+        Free a slot taken by acquire()
+        """
+        with self._condition:
+            self._running -= 1
+            self._condition.notify()
+
+
+class TokenBuckets:
+    """
+    Token bucket rate limits, one bucket per key
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """
+        Take a token from the bucket of key, refilled at rate tokens per
+        second up to burst
+
+        :return: 0 if a token was taken, otherwise the seconds until one
+            is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_TRACKED_KEYS:
+                self._drop_full(now, rate, burst)
+            return (1 - tokens) / rate
+
+    def _drop_full(self, now, rate, burst):
+        """
+        Forget the buckets that have refilled, which behave as new ones
+        """
+        self._buckets = {key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                         if tokens + (now - updated) * rate < burst}
+
+
+BUCKETS = TokenBuckets()
+
+# ConcurrencyLimit of each operation declaring one, by operationId, and
+# by operationId + LONG_POLL for x-long-poll-concurrency
+LIMITS = {}
+LONG_POLL = ':long_poll'
+
+
+def _refuse(operation_id, reason, code, message, retry_after):
+    """
+    Error response for a request refused by admission control
+    """
+    REJECTIONS.labels(operation=operation_id, reason=reason).inc()
+    err = dict(message=message, code=code)
+    return err, code, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+
+def admit(function, operation_id, limit=None, long_poll_limit=None):
+    """
+    Wrap an operation's function with the per-key rate limit and, when
+    given, the operation's ConcurrencyLimit, or its long_poll_limit for
+    requests with a timeout
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        request_limit = long_poll_limit if long_poll_limit and kwargs.get('timeout') else limit
+        config = flask.current_app.config
+        rate = config.get('RATE_LIMIT')
+        if rate:
+            wait = BUCKETS.take(flask.request.headers.get('Authorization'), rate,
+                                max(1, config.get('RATE_LIMIT_BURST') or rate))
+            if wait:
+                return _refuse(operation_id, 'rate_limited', 429,
+                               'Rate limit exceeded for this API key', wait)
+
+        if request_limit is None or not config.get('CONCURRENCY_LIMITS', True):
+            return function(*args, **kwargs)
+        if not request_limit.acquire():
+            return _refuse(operation_id, 'overloaded', 503,
+                           'Too many concurrent requests for this operation', request_limit.timeout)
+        try:
+            response = function(*args, **kwargs)
+        except BaseException:
+            request_limit.release()
+            raise
+        if isinstance(response, flask.Response) and response.is_streamed:
+            # an export holds its slot until its body has been sent
+            response.call_on_close(request_limit.release)
+        else:
+            request_limit.release()
+        return response
+
+    return wrapper
+
+
+class AdmissionResolver(Resolver):
+    """
+    Resolver wrapping the function of each operation with admit(), using
+    the operation's x-concurrency and x-long-poll-concurrency limits if
+    it declares them
+    """
+
+    def resolve(self, operation):
+        resolution = super().resolve(operation)
+        operation_id = resolution.operation_id
+        # connexion 2 has no public accessor for the operation's extensions
+        extensions = operation._operation  # pylint: disable=protected-access
+        limits = {}
+        for extension, name in (('x-concurrency', operation_id),
+                                ('x-long-poll-concurrency', operation_id + LONG_POLL)):
+            if extensions.get(extension):
+                limits[name] = LIMITS[name] = ConcurrencyLimit(name, **extensions[extension])
+        return Resolution(admit(resolution.function, operation_id, limits.get(operation_id),
+                                limits.get(operation_id + LONG_POLL)),
+                          operation_id)
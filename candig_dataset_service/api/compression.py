@@ -0,0 +1,148 @@
+"""
+Response compression negotiated with Accept-Encoding
+
+compress_response is registered as an after_request hook by
+configure_app. Settings are read from the app config:
+
+- COMPRESS_ENCODINGS: encodings offered, in order of preference among
+  those the client accepts with the same quality; br and zstd are only
+  offered when the brotli and zstandard packages are installed
+- COMPRESS_MIN_SIZE: responses smaller than this many bytes are sent
+  as they are
+- COMPRESS_LEVEL: compression level, or None for the default of each
+  encoding
+
+Streamed responses (e.g. NDJSON) are compressed chunk by chunk as they
+are sent, whatever their size, rather than being buffered first.
+"""
+
+import zlib
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/problem+json', 'application/x-ndjson',
+                          'application/xml', 'text/html', 'text/plain', 'text/csv'}
+
+DEFAULT_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+
+
+class _BrotliCompressor():
+    """brotli.Compressor with the compress/flush methods of zlib objects"""
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        """Compress a chunk, returning what is ready to send"""
+        return self._compressor.process(data)
+
+    def flush(self):
+        """End the stream"""
+        return self._compressor.finish()
+
+
+def _compressors():
+    """Compressor factories of the available encodings, taking a level"""
+    factories = {'gzip': lambda level: zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)}
+    if brotli is not None:
+        factories['br'] = _BrotliCompressor
+    if zstandard is not None:
+        factories['zstd'] = lambda level: zstandard.ZstdCompressor(level=level).compressobj()
+    return factories
+
+
+COMPRESSORS = _compressors()
+
+AVAILABLE_ENCODINGS = tuple(name for name in ('br', 'zstd', 'gzip') if name in COMPRESSORS)
+
+
+def choose_encoding(accept_encodings, offered):
+    """
+    Encoding to respond with
+
+    :param accept_encodings: werkzeug Accept of the request's Accept-Encoding
+    :param offered: encodings the server offers, most preferred first
+    :return: name of the encoding, or None to send the response as it is
+    """
+    best, best_quality = None, 0
+    for name in offered:
+        if name not in COMPRESSORS:
+            continue
+        quality = accept_encodings[name]
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def compress_stream(chunks, encoding, level=None):
+    """
+    Compress a stream of bytes chunks incrementally
+
+    :param chunks: iterable of bytes
+    :param encoding: one of AVAILABLE_ENCODINGS
+    :param level: compression level, None for the encoding's default
+    :return: generator of compressed bytes
+    """
+    compressor = COMPRESSORS[encoding](DEFAULT_LEVELS[encoding] if level is None else level)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _weaken_etag(response):
+    """
+    A compressed body is not byte-identical to the uncompressed one,
+    so its entity tag can only be weak
+    """
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(response):
+    """
+    after_request hook compressing the response body with the best
+    encoding accepted by the client
+    """
+    config = flask.current_app.config
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(flask.request.accept_encodings,
+                               config.get('COMPRESS_ENCODINGS', AVAILABLE_ENCODINGS))
+    if encoding is None or 'Content-Encoding' in response.headers \
+            or 'no-transform' in response.headers.get('Cache-Control', ''):
+        return response
+    if response.status_code == 304:
+        _weaken_etag(response)
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206):
+        return response
+
+    level = config.get('COMPRESS_LEVEL')
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+        response.set_data(b''.join(compress_stream((data,), encoding, level)))
+
+    response.headers['Content-Encoding'] = encoding
+    _weaken_etag(response)
+    return response
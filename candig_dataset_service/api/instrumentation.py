@@ -0,0 +1,90 @@
+"""
+Per-operation database metrics
+
+Each API operation is run in a collect_queries() block. The number of
+queries, the time spent in them and the rows they returned are recorded
+in Prometheus histograms labelled with the operationId, and sent to the
+client in a Server-Timing header, e.g.::
+
+    Server-Timing: db;dur=1.52;desc="3 queries, 20 rows"
+
+The statements of an operation slower than SLOW_QUERIES.threshold are
+logged, with their parameters, time and plan.
+"""
+
+import functools
+
+import flask
+from prometheus_client import Histogram
+from connexion.resolver import Resolver, Resolution
+
+from candig_dataset_service.api.logging import logger, structured_log as struct_log
+from candig_dataset_service.orm.instrumentation import collect_queries
+
+QUERIES = Histogram('dataset_service_db_queries', 'Database queries per request',
+                    ['operation'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+
+QUERY_SECONDS = Histogram('dataset_service_db_seconds', 'Time spent in database queries per request',
+                          ['operation'],
+                          buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+
+ROWS = Histogram('dataset_service_db_rows', 'Rows returned by database queries per request',
+                 ['operation'], buckets=(0, 1, 10, 100, 1000, 10000, 100000))
+
+
+def instrument(function, operation_id):
+    """
+    Wrap an operation's function to record the queries it runs
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with collect_queries() as stats:
+            try:
+                return function(*args, **kwargs)
+            finally:
+                QUERIES.labels(operation=operation_id).observe(stats.count)
+                QUERY_SECONDS.labels(operation=operation_id).observe(stats.seconds)
+                ROWS.labels(operation=operation_id).observe(stats.rows)
+                flask.g.query_stats = stats
+                _log_slow_queries(operation_id, stats)
+
+    return wrapper
+
+
+def _log_slow_queries(operation_id, stats):
+    """
+    Log the slow statements of an operation
+    """
+    for query, statement, parameters, seconds in stats.slow:
+        logger().warning(struct_log(action='slow_query', operation=operation_id,
+                                    fingerprint=query.fingerprint, duration_ms=round(seconds * 1000, 3),
+                                    statement=statement, parameters=parameters, plan=query.plan))
+
+
+def add_server_timing(response):
+    """
+    after_request hook adding the queries of the operation to the
+    Server-Timing header
+    """
+    stats = flask.g.get('query_stats')
+    if stats is not None:
+        response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries, {} rows"'.format(
+            stats.seconds * 1000, stats.count, stats.rows))
+    return response
+
+
+class InstrumentingResolver(Resolver):
+    """
+    Resolver wrapping the functions resolved by another resolver with
+    instrument()
+    """
+
+    def __init__(self, resolver):
+        super().__init__()
+        self.resolver = resolver
+
+    def resolve(self, operation):
+        resolution = self.resolver.resolve(operation)
+        return Resolution(instrument(resolution.function, resolution.operation_id),
+                          resolution.operation_id)
@@ -1,24 +1,34 @@
-
 """
 Logging wrappers for api calls
+
+apilog records each API call. What it records is set in the app config:
+
+- LOG_SAMPLE_RATE: percentage of calls logged (default 100), overridden
+  per handler by LOG_SAMPLE_RATES, e.g. ``{'search_datasets': 10}``
+- LOG_BODY_BYTES: bytes of the request body kept (default 1024; 0 drops
+  the body, None keeps all of it)
+- LOG_HEADERS: names of the request headers logged (default
+  DEFAULT_LOG_HEADERS; the Authorization key is never logged by default)
+
+BackgroundHandler moves the writing of log records off the request
+threads, to a listener thread.
 """
 
-import json
+import os
+import queue
+import random
+import logging
+import threading
 from datetime import datetime
-from uuid import UUID
+from logging.handlers import QueueHandler, QueueListener
+
 from decorator import decorator
 from connexion import request
 from flask import current_app
 
+from candig_dataset_service.api.serialization import dumps
 
-class FieldEncoder(json.JSONEncoder):
-    """Wrap fields to be JSON-safe; handle datetime & UUID"""
-    def default(self, obj):
-        if isinstance(obj, UUID):
-            return str(obj)
-        if isinstance(obj, datetime):
-            return str(obj)
-        return json.JSONEncoder.default(self, obj)
+DEFAULT_LOG_HEADERS = ('Content-Type', 'Content-Length', 'User-Agent', 'X-Forwarded-For')
 
 
 def structured_log(**kwargs):
@@ -26,10 +36,10 @@ def structured_log(**kwargs):
 
     JSON string of keyword arguments
     """
-    entrydict = {"timestamp": str(datetime.now())}
+    entrydict = {"timestamp": datetime.now().isoformat()}
     for key in kwargs:
         entrydict[key] = kwargs[key]
-    return json.dumps(entrydict, skipkeys=True, cls=FieldEncoder)
+    return dumps(entrydict, default=str)
 
 
 def logger():
@@ -37,18 +47,44 @@ def logger():
     return current_app.logger
 
 
+def _sampled(name):
+    """
+    Whether the call of the handler named name is logged, per
+    LOG_SAMPLE_RATES and LOG_SAMPLE_RATE
+    """
+    config = current_app.config
+    rate = config.get('LOG_SAMPLE_RATES', {}).get(name, config.get('LOG_SAMPLE_RATE', 100))
+    return rate >= 100 or random.random() * 100 < rate
+
+
+def _request_body():
+    """
+    The request body as text, truncated to LOG_BODY_BYTES
+    """
+    limit = current_app.config.get('LOG_BODY_BYTES', 1024)
+    data = request.get_data(cache=True)
+    if limit is not None and len(data) > limit:
+        return data[:limit].decode('utf-8', 'replace') + '...[{} bytes]'.format(len(data))
+    return data.decode('utf-8', 'replace')
+
+
 @decorator
 def apilog(func, *args, **kwargs):
     """
     Logging decorator for API calls
     """
-    entrydict = {"timestamp": str(datetime.now())}
+    if not current_app.logger.isEnabledFor(logging.INFO) or not _sampled(func.__name__):
+        return func(*args, **kwargs)
+
+    entrydict = {"timestamp": datetime.now().isoformat()}
     try:
         entrydict['method'] = request.method
         entrydict['path'] = request.full_path
-        entrydict['data'] = str(request.data)
+        if current_app.config.get('LOG_BODY_BYTES', 1024) != 0:
+            entrydict['data'] = _request_body()
         entrydict['address'] = request.remote_addr
-        entrydict['headers'] = str(request.headers)
+        names = current_app.config.get('LOG_HEADERS', DEFAULT_LOG_HEADERS)
+        entrydict['headers'] = {name: request.headers[name] for name in names if name in request.headers}
 
     except RuntimeError:
         entrydict['called'] = func.__name__
@@ -56,7 +92,59 @@ def apilog(func, *args, **kwargs):
         for key in kwargs:
             entrydict[key] = kwargs[key]
 
-    logentry = json.dumps(entrydict, cls=FieldEncoder)
+    logentry = dumps(entrydict, default=str)
 
     current_app.logger.info(logentry)
     return func(*args, **kwargs)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Handler queueing records for a listener thread, which writes them
+    with the wrapped handlers, so that requests do not wait on the log
+    file. Threads do not survive a fork: each process (e.g. each
+    preforked uwsgi worker) starts its own listener on first use.
+    """
+
+    def __init__(self, *handlers):
+        """
+        :param handlers: handlers writing the records, e.g. a FileHandler
+        """
+        super().__init__(queue.SimpleQueue())
+        self.handlers = handlers
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, record):
+        self._ensure_started()
+        super().enqueue(record)
+
+    def _ensure_started(self):
+        """
+        Start the listener, once per process
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # records queued before a fork are written by the parent
+            self.queue = queue.SimpleQueue()
+            self._listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = pid
+
+    def close(self):
+        """
+        Write the queued records and stop the listener
+        """
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+        for handler in self.handlers:
+            handler.close()
+        super().close()
@@ -2,28 +2,67 @@
 Methods to handle incoming service requests
 """
 
+import copy
 import json
+import functools
+import math
+import time
 import datetime
+import hashlib
 import uuid
+import threading
+import urllib.parse
 import pkg_resources
 
 import flask
+from decorator import decorator
 
-from sqlalchemy import exc, or_
+from sqlalchemy import exc, func
+from sqlalchemy.orm import exc as orm_exc
 
 
-from candig_dataset_service.orm.models import Dataset, ChangeLog
-from candig_dataset_service.orm import get_session, ORMException, dump
+from candig_dataset_service.orm.models import Dataset, DatasetEvent, ChangeLog, IdempotencyKey
+from candig_dataset_service.orm import get_session, get_read_session, get_replicas, get_engine, \
+    get_writer, ORMException
+from candig_dataset_service.orm.serializers import dataset_serializer, changelog_serializer, \
+    dataset_event_serializer
+from candig_dataset_service.orm.export import export_lines, gzip_stream, parse_timestamp
+from candig_dataset_service.orm.instrumentation import SLOW_QUERIES
+from candig_dataset_service.orm.queries import dataset_filters, delete_datasets as delete_matching, \
+    in_chunks
 from candig_dataset_service.api.logging import apilog, logger
 from candig_dataset_service.api.logging import structured_log as struct_log
 from candig_dataset_service.api.models import Version
-from candig_dataset_service.api.exceptions import IdentifierFormatError
+from candig_dataset_service.api.profiling import profile_path
+from candig_dataset_service.api.exceptions import IdentifierFormatError, AuthorizationError
+from candig_dataset_service.auth import require_admin
 from candig_dataset_service.ontologies.duo import OntologyParser, OntologyValidator, ont
 
 
 
 APP = flask.current_app
 
+_PATCHABLE_FIELDS = ('version', 'tags', 'name', 'description', 'ontologies')
+
+# Reads are served by the primary until this time after a client's write
+READ_PRIMARY_COOKIE = 'datasets_read_primary_until'
+_RECENT_WRITERS = {}
+
+# Long-polls on the change feed wait on this condition, and re-query the
+# database at least every CHANGES_POLL_INTERVAL seconds for changes made
+# by other processes
+CHANGES_POLL_INTERVAL = 0.5
+_CHANGES = threading.Condition()
+_changes_generation = 0
+
+# Ids looked up per IN (...) query by get_datasets and lookup_datasets
+LOOKUP_CHUNK_SIZE = 500
+
+# Expired idempotency keys are purged at most once per interval (seconds)
+# in each process, rather than on every request bringing a new key
+IDEMPOTENCY_PURGE_INTERVAL = 300
+_idempotency_purged = None
+
 
 def _report_search_failed(typename, exception, **kwargs):
     """
@@ -98,7 +137,308 @@ def _report_write_error(typename, exception, **kwargs):
     err = dict(message=message, code=500)
     return err
 
+
+def _expand_ontologies(ontologies):
+    """
+    Validate incoming ontology terms and enrich DUO terms with
+    their name, definition and shorthand
+
+    :param ontologies: list of {'id': ontology_name, 'terms': [{'id': 'some code'}]}
+    :return: (ontologies to store, ontologies_internal lookup, error or None)
+    """
+    mapped = {ontology['id']: ontology['terms'] for ontology in ontologies}
+    if 'duo' not in mapped.keys():
+        return ontologies, mapped, None
+
+    validator = OntologyValidator(ont=ont, input_json=mapped)
+    valid, invalids = validator.validate_duo()
+
+    if not valid:
+        err = dict(message="DUO Validation Errors encountered: " + str(invalids), code=400)
+        return None, None, err
+
+    duos = [{**term, **_duo_overview(term["id"])} for term in mapped['duo']]
+
+    return duos, mapped, None
+
+
+@functools.lru_cache(maxsize=None)
+def _duo_overview(term_id):
+    """
+    Name, definition and shorthand of a DUO term. The ontology is
+    loaded once at startup, so these never change.
+    """
+    return OntologyParser(ont, term_id).get_overview()
+
+
+def _request_header(name):
+    """
+    Value of an incoming request header, or None when called
+    outside of a request (e.g. directly from the CLI or tests)
+    """
+    if not flask.has_request_context():
+        return None
+    return flask.request.headers.get(name)
+
+
+def _dataset_etag(dataset_id, revision):
+    """
+    Strong entity tag for a dataset at a given revision
+    """
+    return '"{}-{}"'.format(uuid.UUID(str(dataset_id)).hex, revision)
+
+
+def _etag(*markers):
+    """
+    Strong entity tag for a representation identified by version
+    markers, e.g. the latest dataset event or change log date
+    """
+    digest = hashlib.sha1(repr(markers).encode('utf-8')).hexdigest()
+    return '"{}"'.format(digest[:20])
+
+
+def _cache_headers(etag):
+    """
+    ETag and Cache-Control headers of a read, returned with its 200 or
+    304 so that response validation sees them
+    """
+    max_age = flask.current_app.config.get('CACHE_MAX_AGE', 0) if flask.has_app_context() else 0
+    return {'ETag': etag, 'Cache-Control': 'public, max-age={}, must-revalidate'.format(max_age)}
+
+
+def _not_modified(etag):
+    """
+    Tell whether the client's If-None-Match already holds the
+    representation tagged etag, so that a 304 can be returned before
+    anything else is read. Always False outside of a request.
+    """
+    if not flask.has_request_context():
+        return False
+    return flask.request.if_none_match.contains_weak(etag.strip('"'))
+
+
+def _catalog_generation(db_session):
+    """
+    Sequence number of the latest dataset event, which every write to
+    the datasets table records in the same transaction
+    """
+    return db_session.query(func.max(DatasetEvent.seq)).scalar() or 0
+
+
+def _insert(db_session, *objects):
+    """
+    Insert new ORM objects in one transaction. When the group-commit
+    writer is enabled the objects are handed to it and this blocks
+    until the batch containing them has been committed.
+
+    :raises ORMException: on failure, after rolling back db_session
+    """
+    writer = get_writer()
+    if writer:
+        writer.submit(*objects).result()
+        _after_write()
+        return
+
+    try:
+        db_session.add_all(objects)
+        db_session.commit()
+    except ORMException:
+        db_session.rollback()
+        raise
+    _after_write()
+
+
+def _after_write():
+    """
+    Bookkeeping once a write of the current request has committed
+    """
+    _notify_changes()
+    _record_write()
+
+
+def _notify_changes():
+    """
+    Wake the long-polls of this process waiting for a new change
+    """
+    global _changes_generation
+    with _CHANGES:
+        _changes_generation += 1
+        _CHANGES.notify_all()
+
+
+def _wait_for_changes(generation, timeout):
+    """
+    Wait until _notify_changes() has been called since generation was
+    read, or until the timeout
+    """
+    with _CHANGES:
+        _CHANGES.wait_for(lambda: _changes_generation != generation, timeout)
+
+
+def _record_write():
+    """
+    Serve the current client's reads from the primary for the next
+    READ_YOUR_WRITES seconds, so that they see their own writes before
+    the replicas have caught up. The deadline is kept per API key in
+    this process and in a cookie, which reaches the other workers.
+    """
+    if not flask.has_request_context() or not get_replicas():
+        return
+    window = flask.current_app.config.get('READ_YOUR_WRITES', 5)
+    if window <= 0:
+        return
+
+    now = time.time()
+    until = now + window
+    api_key = flask.request.headers.get('Authorization')
+    if api_key:
+        if len(_RECENT_WRITERS) > 10000:
+            for key, deadline in list(_RECENT_WRITERS.items()):
+                if deadline <= now:
+                    _RECENT_WRITERS.pop(key, None)
+        _RECENT_WRITERS[api_key] = until
+
+    @flask.after_this_request
+    def set_cookie(response):  # pylint:disable=unused-variable
+        response.set_cookie(READ_PRIMARY_COOKIE, '{:.3f}'.format(until),
+                            max_age=math.ceil(window), httponly=True)
+        return response
+
+
+def _read_session():
+    """
+    Session for read-only handlers: a replica, unless the client
+    has written within the read-your-writes window
+    """
+    if not flask.has_request_context() or not get_replicas():
+        return get_read_session()
+
+    now = time.time()
+    try:
+        cookie_deadline = float(flask.request.cookies.get(READ_PRIMARY_COOKIE, 0))
+    except ValueError:
+        cookie_deadline = 0
+    key_deadline = _RECENT_WRITERS.get(flask.request.headers.get('Authorization'), 0)
+    return get_read_session(primary=max(cookie_deadline, key_deadline) > now)
+
+
+@decorator
+def idempotent(handler, *args, **kwargs):
+    """
+    Idempotency-Key support for POST handlers taking a single body.
+
+    A request repeating a key is answered with the response stored for
+    it, found with one primary key lookup, without re-running the
+    handler. The handler stores the response for a new key in the same
+    transaction as its insert, via _idempotency_records().
+    """
+    key = _request_header('Idempotency-Key')
+    if not key:
+        return handler(*args, **kwargs)
+
+    body = kwargs['body'] if 'body' in kwargs else args[0]
+    request_hash = hashlib.sha256(
+        (handler.__name__ + json.dumps(body, sort_keys=True, default=str)).encode('utf-8')
+    ).hexdigest()
+
+    db_session = get_session()
+    replay = _replay_idempotent(db_session, key, request_hash)
+    if replay:
+        return replay
+
+    try:
+        _purge_idempotency_keys(db_session)
+    except ORMException as e:
+        err = _report_write_error('idempotency key', e, key=key)
+        return err, 500
+
+    flask.g.idempotency = (key, request_hash)
+    response, status = handler(*args, **kwargs)
+
+    if not 200 <= status < 300:
+        # a concurrent request with the same key may have won the insert
+        replay = _replay_idempotent(db_session, key, request_hash)
+        if replay:
+            return replay
+
+    return response, status
+
+
+def _replay_idempotent(db_session, key, request_hash):
+    """
+    Stored (response, status) for an unexpired idempotency key, an error
+    if the key was used for a different request, or None if unknown
+    """
+    try:
+        record = db_session.query(IdempotencyKey).get(key)
+    except ORMException as e:
+        err = _report_search_failed('idempotency key', e, key=key)
+        return err, 500
+
+    if not record:
+        return None
+
+    if record.expires < datetime.datetime.utcnow():
+        # the key is free again: make way for the record of its new request
+        try:
+            db_session.delete(record)
+            db_session.commit()
+        except ORMException as e:
+            db_session.rollback()
+            err = _report_write_error('idempotency key', e, key=key)
+            return err, 500
+        return None
+
+    if record.request_hash != request_hash:
+        err = dict(message="Idempotency-Key was already used for a different request", code=422)
+        return err, 422
+
+    return record.response, record.status
+
+
+def _purge_idempotency_keys(db_session):
+    """
+    Delete expired idempotency keys, at most once every
+    IDEMPOTENCY_PURGE_INTERVAL seconds
+
+    :raises ORMException: on failure, after rolling back db_session
+    """
+    global _idempotency_purged
+    now = time.monotonic()
+    if _idempotency_purged is not None and now - _idempotency_purged < IDEMPOTENCY_PURGE_INTERVAL:
+        return
+    _idempotency_purged = now
+
+    try:
+        db_session.query(IdempotencyKey) \
+            .filter(IdempotencyKey.expires < datetime.datetime.utcnow()) \
+            .delete(synchronize_session=False)
+        db_session.commit()
+    except ORMException:
+        db_session.rollback()
+        raise
+
+
+def _idempotency_records(response, status):
+    """
+    IdempotencyKey rows to insert along with a new object, recording the
+    response for the current request's Idempotency-Key (if any)
+    """
+    if not flask.has_request_context() or 'idempotency' not in flask.g:
+        return []
+
+    key, request_hash = flask.g.idempotency
+    ttl = flask.current_app.config.get('IDEMPOTENCY_TTL', 86400)
+    return [IdempotencyKey(
+        key=key,
+        request_hash=request_hash,
+        response=json.loads(flask.json.dumps(response)),
+        status=status,
+        expires=datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl))]
+
+
 @apilog
+@idempotent
 def post_dataset(body):
     """
     Creates a new dataset following the dataset_ingest
@@ -132,29 +472,14 @@ def post_dataset(body):
         body['version'] = Version
 
     body['created'] = datetime.datetime.utcnow()
+    body['revision'] = 1  # the ORM bumps this on every update
     mapped = []
 
     if body.get('ontologies'):
-
-        # Ontology objects should be {'id': ontology_name, 'terms': [{'id': 'some code'}]}
-
-        mapped = {ontology['id']: ontology['terms'] for ontology in body['ontologies']}
-        if 'duo' in mapped.keys():
-            validator = OntologyValidator(ont=ont, input_json=mapped)
-            valid, invalids = validator.validate_duo()
-
-            if not valid:
-                err = dict(message="DUO Validation Errors encountered: " + str(invalids), code=400)
-                return err, 400
-
-            duo_terms = json.loads(validator.get_duo_list())
-            duos = []
-
-            for term in duo_terms:
-                stuff = OntologyParser(ont, term["id"]).get_overview()
-                duos.append({**term, **stuff})
-
-            body['ontologies'] = duos
+        ontologies, mapped, err = _expand_ontologies(body['ontologies'])
+        if err:
+            return err, 400
+        body['ontologies'] = ontologies
     body['ontologies_internal'] = mapped
 
     try:
@@ -163,12 +488,15 @@ def post_dataset(body):
         err = _report_conversion_error('dataset', e, **body)
         return err, 400
 
+    response = {k: v for k, v in body.items() if k != 'ontologies_internal'}
+    response.update(dataset_serializer.from_mapping(body))
+
     try:
-        db_session.add(orm_dataset)
-        db_session.commit()
+        event = DatasetEvent(dataset_id=iid, action='created', revision=1, created=body['created'])
+        _insert(db_session, orm_dataset, event, *_idempotency_records(response, 201))
     except exc.IntegrityError:
         db_session.rollback()
-        err = _report_object_exists('dataset: ' + body['id'], **body)
+        err = _report_object_exists('dataset: ' + str(body['id']), **body)
         return err, 405
     except ORMException as e:
         db_session.rollback()
@@ -176,6 +504,7 @@ def post_dataset(body):
         return err, 500
 
     body.pop('ontologies_internal')
+    body.update(response)
     return body, 201
 
 
@@ -188,6 +517,107 @@ def get_dataset_by_id(dataset_id):
     :return: dataset specified by UUID, 200 on success. Error code on failure.
     :rtype: dataset schema, int
     """
+    db_session = _read_session()
+
+    try:
+        validate_uuid_string('id', dataset_id)
+        if _request_header('If-None-Match'):
+            # a revalidation only reads the revision
+            revision = db_session.query(Dataset.revision) \
+                .filter(Dataset.id == dataset_id).scalar()
+            if revision is not None and _not_modified(_dataset_etag(dataset_id, revision)):
+                return None, 304, _cache_headers(_dataset_etag(dataset_id, revision))
+        specified_dataset = db_session.query(*dataset_serializer.columns) \
+            .filter(Dataset.id == dataset_id).first()
+    except IdentifierFormatError as e:
+        err = dict(
+            message=str(e),
+            code=404)
+        return err, 404
+
+    if not specified_dataset:
+        err = dict(message="Dataset not found: " + str(dataset_id), code=404)
+        return err, 404
+
+    etag = _dataset_etag(specified_dataset.id, specified_dataset.revision)
+    return dataset_serializer(specified_dataset), 200, _cache_headers(etag)
+
+
+@apilog
+def get_datasets(ids):
+    """
+    :param ids: UUIDs
+    :type ids: list of strings
+
+    :return: {'datasets': [...], 'missing': [...]}, 200 on success. Error code on failure.
+    """
+    return _lookup_datasets(ids)
+
+
+@apilog
+def lookup_datasets(body):
+    """
+    get_datasets for lists of ids too long for a query string
+
+    :param body: {'ids': [UUID, ...]}
+    :type body: object
+
+    :return: {'datasets': [...], 'missing': [...]}, 200 on success. Error code on failure.
+    """
+    return _lookup_datasets(body['ids'])
+
+
+def _lookup_datasets(ids):
+    """
+    The datasets with the given ids, in the order given, fetched
+    LOOKUP_CHUNK_SIZE at a time with one IN (...) query each, and the
+    ids without a dataset (as 32-character hex strings)
+    """
+    wanted = []
+    invalid = []
+    for dataset_id in ids:
+        try:
+            wanted.append(uuid.UUID(dataset_id).hex)
+        except ValueError:
+            invalid.append(dataset_id)
+    if invalid:
+        err = dict(message="{}: {}".format(IdentifierFormatError('ids'), ', '.join(invalid)), code=400)
+        return err, 400
+    wanted = list(dict.fromkeys(wanted))
+
+    db_session = _read_session()
+    try:
+        rows = in_chunks(db_session.query(*dataset_serializer.columns), Dataset.id, wanted,
+                         chunk_size=LOOKUP_CHUNK_SIZE)
+    except ORMException as e:
+        err = _report_search_failed('dataset', e)
+        return err, 500
+
+    found = {dataset['id']: dataset for dataset in map(dataset_serializer, rows)}
+    return dict(datasets=[found[dataset_id] for dataset_id in wanted if dataset_id in found],
+                missing=[dataset_id for dataset_id in wanted if dataset_id not in found]), 200
+
+
+@apilog
+def patch_dataset(dataset_id, body):
+    """
+    Applies a JSON merge patch (RFC 7396) to an existing dataset.
+    Only the columns that actually change are written, and DUO
+    enrichment is only re-run when the ontologies change.
+
+    Members set to null are reset to their defaults. Concurrent
+    writers are detected through the dataset revision: the UPDATE
+    only matches the revision that was read, and an If-Match header
+    can pin the revision the client last saw.
+
+    :param dataset_id: UUID
+    :type dataset_id: string
+    :param body: merge patch following the dataset_patch schema
+    :type body: object
+
+    :return: updated dataset, 200 on success. Error code on failure.
+    :rtype: dataset schema, int
+    """
     db_session = get_session()
 
     try:
@@ -199,12 +629,72 @@ def get_dataset_by_id(dataset_id):
             message=str(e),
             code=404)
         return err, 404
+    except ORMException as e:
+        err = _report_search_failed('dataset', e, dataset_id=str(dataset_id))
+        return err, 500
 
     if not specified_dataset:
         err = dict(message="Dataset not found: " + str(dataset_id), code=404)
         return err, 404
 
-    return dump(specified_dataset), 200
+    if_match = _request_header('If-Match')
+    current_etag = _dataset_etag(specified_dataset.id, specified_dataset.revision)
+    # tags of compressed responses are weak, but name the same revision
+    if if_match and if_match.strip().replace('W/', '', 1) not in ('*', current_etag):
+        err = dict(message="Dataset has been modified: " + str(dataset_id), code=412)
+        return err, 412
+
+    unknown = set(body) - set(_PATCHABLE_FIELDS)
+    if unknown:
+        err = dict(message="Fields cannot be patched: " + ", ".join(sorted(unknown)), code=400)
+        return err, 400
+
+    changes = {}
+    for key, value in body.items():
+        if value is None:
+            default = Dataset.__table__.columns[key].default
+            value = copy.copy(default.arg) if default is not None else None
+        changes[key] = value
+
+    if 'ontologies' in changes:
+        mapped = {ontology['id']: ontology['terms'] for ontology in changes['ontologies']}
+        if mapped == specified_dataset.ontologies_internal:
+            changes.pop('ontologies')
+        else:
+            ontologies, mapped, err = _expand_ontologies(changes['ontologies'])
+            if err:
+                return err, 400
+            changes['ontologies'] = ontologies
+            changes['ontologies_internal'] = mapped
+
+    for key, value in changes.items():
+        setattr(specified_dataset, key, value)
+
+    if db_session.is_modified(specified_dataset):
+        specified_dataset.updated = datetime.datetime.utcnow()
+        db_session.add(DatasetEvent(dataset_id=specified_dataset.id, action='updated',
+                                    revision=specified_dataset.revision + 1,
+                                    created=specified_dataset.updated))
+
+    try:
+        db_session.commit()
+    except orm_exc.StaleDataError:
+        db_session.rollback()
+        err = dict(message="Dataset was modified concurrently: " + str(dataset_id), code=409)
+        return err, 409
+    except exc.IntegrityError:
+        db_session.rollback()
+        err = _report_object_exists('dataset: ' + str(changes.get('name')), dataset_id=str(dataset_id))
+        return err, 405
+    except ORMException as e:
+        db_session.rollback()
+        err = _report_update_failed('dataset', e, dataset_id=str(dataset_id))
+        return err, 500
+
+    _after_write()
+    db_session.refresh(specified_dataset)
+    etag = _dataset_etag(specified_dataset.id, specified_dataset.revision)
+    return dataset_serializer.from_object(specified_dataset), 200, {'ETag': etag}
 
 
 @apilog
@@ -232,14 +722,147 @@ def delete_dataset_by_id(dataset_id):
     try:
         row = db_session.query(Dataset).filter(Dataset.id == dataset_id).first()
         db_session.delete(row)
+        db_session.add(DatasetEvent(dataset_id=row.id, action='deleted', revision=row.revision,
+                                    created=datetime.datetime.utcnow()))
         db_session.commit()
     except ORMException as e:
         err = _report_update_failed('dataset', e, dataset_id=str(dataset_id))
         return err, 500
 
+    _after_write()
     return None, 204
 
 
+@apilog
+def delete_datasets(body):
+    """
+    Deletes every dataset matching the search_datasets filters
+    in a single statement. Admin only.
+
+    :param body: {'tags': [], 'version': '', 'ontologies': [], 'dry_run': bool}
+    :type body: object
+
+    :return: number of datasets deleted (or matched, for a dry run), 200 on success
+    :rtype: object, int
+    """
+    try:
+        require_admin()
+    except AuthorizationError as e:
+        err = dict(message=str(e), code=403)
+        return err, 403
+
+    dry_run = bool(body.get('dry_run'))
+    criteria = dataset_filters(tags=body.get('tags'), version=body.get('version'),
+                               ontologies=body.get('ontologies'))
+    if not criteria:
+        err = dict(message="At least one of tags, version or ontologies is required", code=400)
+        return err, 400
+
+    db_session = get_session()
+
+    try:
+        count = delete_matching(db_session, criteria, dry_run=dry_run)
+        db_session.commit()
+    except ORMException as e:
+        db_session.rollback()
+        err = _report_update_failed('dataset', e, **body)
+        return err, 500
+
+    if not dry_run:
+        _after_write()
+    logger().info(struct_log(action='delete_datasets', count=count, **body))
+
+    return dict(count=count, dry_run=dry_run), 200
+
+
+@apilog
+def export_datasets(since=None):
+    """
+    Streams a consistent point-in-time snapshot of all datasets and
+    change logs as gzip-compressed NDJSON, ending with a manifest line
+    holding record counts and checksums. Admin only.
+
+    :param since: only export records created or updated from this date-time on
+    :type since: string
+
+    :return: streamed export, 200 on success. Error code on failure.
+    """
+    try:
+        require_admin()
+    except AuthorizationError as e:
+        err = dict(message=str(e), code=403)
+        return err, 403
+
+    try:
+        since = parse_timestamp(since)
+    except ValueError:
+        err = dict(message="since must be an ISO 8601 date-time: " + str(since), code=400)
+        return err, 400
+
+    filename = 'datasets-{}.ndjson.gz'.format(datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ'))
+    return flask.Response(gzip_stream(export_lines(get_engine(), since=since)),
+                          mimetype='application/gzip',
+                          headers={'Content-Disposition': 'attachment; filename=' + filename},
+                          direct_passthrough=True)
+
+
+@apilog
+def get_slow_queries(limit=20):
+    """
+    Lists the statements slower than the slow query threshold seen by
+    this process, grouped by fingerprint, most total time first.
+    Admin only.
+
+    :param limit: number of fingerprints listed
+    :type limit: int
+
+    :return: threshold and slow statements, 200 on success
+    :rtype: object, int
+    """
+    try:
+        require_admin()
+    except AuthorizationError as e:
+        err = dict(message=str(e), code=403)
+        return err, 403
+
+    threshold = SLOW_QUERIES.threshold or 0
+    queries = [query.as_dict() for query in SLOW_QUERIES.top(limit)]
+    return dict(threshold_ms=threshold * 1000, queries=queries), 200
+
+
+@apilog
+def get_profile(profile_id, format='collapsed'):  # pylint: disable=redefined-builtin
+    """
+    Returns the profile of a request sent with X-Profile, by the id
+    returned in its X-Profile-Id header. Admin only.
+
+    :param profile_id: 32 hex digit profile id
+    :type profile_id: string
+    :param format: 'collapsed' stacks, or 'pstats' data
+    :type format: string
+
+    :return: the profile, 200 on success. Error code on failure.
+    """
+    try:
+        require_admin()
+    except AuthorizationError as e:
+        err = dict(message=str(e), code=403)
+        return err, 403
+
+    try:
+        with open(profile_path(profile_id, format), 'rb') as saved:
+            data = saved.read()
+    except FileNotFoundError:
+        err = dict(message="Profile not found: " + profile_id, code=404)
+        return err, 404
+
+    if format == 'pstats':
+        filename = '{}.pstats'.format(profile_id)
+        return flask.Response(data, mimetype='application/octet-stream',
+                              headers={'Content-Disposition': 'attachment; filename=' + filename})
+    return flask.Response(data, mimetype='text/plain')
+
+
 @apilog
 def search_datasets(tags=None, version=None, ontologies=None):
     """
@@ -248,22 +871,18 @@ def search_datasets(tags=None, version=None, ontologies=None):
     :param ontologies: List of ontology terms
     :return: List of datasets matching any of the supplied parameters
     """
-    db_session = get_session()
-    print(tags, version, ontologies)
+    db_session = _read_session()
     try:
-        datasets = db_session.query(Dataset)
-        if version:
-            datasets = datasets.filter(Dataset.version.like('%' + version + '%'))
-        if tags:
-            # return any project that matches at least one tag
-            datasets = datasets.filter(or_(*[Dataset.tags.contains(tag) for tag in tags]))
-        if ontologies:
-            datasets = datasets.filter(or_(*[Dataset.ontologies_internal.contains(term) for term in ontologies]))
-
+        # read before the datasets, so that the tag is never newer than them
+        etag = _etag(_catalog_generation(db_session))
+        if _not_modified(etag):
+            return None, 304, _cache_headers(etag)
+        datasets = db_session.query(*dataset_serializer.columns) \
+            .filter(*dataset_filters(tags=tags, version=version, ontologies=ontologies))
     except ORMException as e:
         err = _report_search_failed('dataset', e)
         return err, 500
-    return [dump(x) for x in datasets], 200
+    return [dataset_serializer(row) for row in datasets], 200, _cache_headers(etag)
 
 
 @apilog
@@ -302,6 +921,51 @@ def get_search_filters(valid_filters):
     return response, 200
 
 
+@apilog
+def get_dataset_changes(since=0, timeout=0, limit=100):
+    """
+    Dataset changes recorded after a cursor, oldest first. When there
+    are none, waits up to timeout seconds for one to be committed,
+    unless the LONG_POLL setting is off.
+
+    :param since: cursor returned by the previous call, 0 for the start of the feed
+    :type since: int
+    :param timeout: seconds to wait for a change when there is none
+    :type timeout: float
+    :param limit: maximum number of changes returned
+    :type limit: int
+
+    :return: {'changes': [...], 'cursor': int}, 200 on success
+    """
+    if not flask.current_app.config.get('LONG_POLL', True):
+        # a single-threaded server would hold up every other request
+        timeout = 0
+    db_session = _read_session()
+    deadline = time.monotonic() + timeout
+
+    while True:
+        generation = _changes_generation
+        try:
+            changes = db_session.query(*dataset_event_serializer.columns) \
+                .filter(DatasetEvent.seq > since) \
+                .order_by(DatasetEvent.seq) \
+                .limit(limit).all()
+        except ORMException as e:
+            err = _report_search_failed('dataset change', e)
+            return err, 500
+        # end the read transaction so that the next query sees new commits
+        db_session.rollback()
+
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            break
+        _wait_for_changes(generation, min(remaining, CHANGES_POLL_INTERVAL))
+
+    changes = [dataset_event_serializer(row) for row in changes]
+    cursor = changes[-1]['seq'] if changes else since
+    return dict(changes=changes, cursor=cursor), 200
+
+
 @apilog
 def search_dataset_ontologies():
     """
@@ -310,15 +974,12 @@ def search_dataset_ontologies():
     :return: List of all ontologies currently used by datasets
     """
 
-    db_session = get_session()
+    db_session = _read_session()
     try:
-        datasets = db_session.query(Dataset)
-
-        valid = datasets.filter(Dataset.ontologies != [])
-
-        ontologies = [dump(x)['ontologies'] for x in valid]
+        # only the ontologies column is read and decoded
+        ontologies = db_session.query(Dataset.ontologies)
 
-        terms = sorted(list(set([term['id'] for ontology in ontologies for term in ontology])))
+        terms = sorted({term['id'] for (ontology,) in ontologies for term in ontology or []})
 
     except ORMException as e:
         err = _report_search_failed('dataset', e)
@@ -358,7 +1019,22 @@ def post_change_log(body):
     :param body: POST body object following the changeLog schema
     :type body: object
 
-    :return: body, 200 on success
+    :return: body, 201 and its Location on success
+    """
+    response, status = _post_change_log(body)
+    if status != 201:
+        return response, status
+    # relative to the URL it was posted to, /datasets/changelog
+    location = 'changelog/' + urllib.parse.quote(response['version'], safe='')
+    return response, status, {'Location': location}
+
+
+@idempotent
+def _post_change_log(body):
+    """
+    post_change_log, with Idempotency-Key replays
+
+    :return: body, 201 on success
     """
     db_session = get_session()
     change_version = body.get('version')
@@ -372,8 +1048,7 @@ def post_change_log(body):
         return err, 400
 
     try:
-        db_session.add(orm_changelog)
-        db_session.commit()
+        _insert(db_session, orm_changelog, *_idempotency_records(body, 201))
     except exc.IntegrityError:
         db_session.rollback()
         err = _report_object_exists('changelog: ' + body['version'], **body)
@@ -385,6 +1060,7 @@ def post_change_log(body):
     logger().info(struct_log(action='post_change_log', status='created',
                              change_version=change_version, **body))
 
+    body.update(changelog_serializer.from_mapping(body))
     return body, 201
 
 
@@ -398,16 +1074,21 @@ def get_versions():
     :return: List of release versions of the database
     :rtype: string
     """
-    db_session = get_session()
+    db_session = _read_session()
     change_log = ChangeLog
 
     try:
+        # change logs are never updated, only added
+        etag = _etag(*db_session.query(func.count(change_log.version),
+                                       func.max(change_log.created)).one())
+        if _not_modified(etag):
+            return None, 304, _cache_headers(etag)
         versions = db_session.query(change_log.version)
     except ORMException as e:
         err = _report_search_failed('versions', e)
         return err, 500
 
-    return [entry.version for entry in versions], 200
+    return [entry.version for entry in versions], 200, _cache_headers(etag)
 
 
 @apilog
@@ -418,12 +1099,17 @@ def get_change_log(version):
     :param version: required release version
     :return: changes associated with specified release version
     """
-    db_session = get_session()
+    db_session = _read_session()
     change_log = ChangeLog
 
     try:
-        log = db_session.query(change_log)\
-            .get(version)
+        if _request_header('If-None-Match'):
+            created = db_session.query(change_log.created) \
+                .filter(change_log.version == version).first()
+            if created and _not_modified(_etag(version, created[0])):
+                return None, 304, _cache_headers(_etag(version, created[0]))
+        log = db_session.query(*changelog_serializer.columns)\
+            .filter(change_log.version == version).first()
     except ORMException as e:
         err = _report_search_failed('change log', e)
         return err, 500
@@ -432,7 +1118,7 @@ def get_change_log(version):
         err = dict(message="Change log not found", code=404)
         return err, 404
 
-    return dump(log), 200
+    return changelog_serializer(log), 200, _cache_headers(_etag(version, log.created))
 
 
 def validate_uuid_string(field_name, uuid_str):
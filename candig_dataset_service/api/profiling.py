@@ -0,0 +1,196 @@
+"""
+On-demand profiling of single API calls
+
+A request sent with an ``X-Profile: true`` header by an admin key runs
+its operation under cProfile. The profile is written to PROFILE_DIR as
+``<id>.pstats`` (for pstats or snakeviz) and ``<id>.collapsed`` (folded
+stacks, for flamegraph.pl or speedscope), and its id is returned in the
+X-Profile-Id response header; see get_profile in operations.
+
+Profiling slows the request it runs in several times over, so at most
+one request is profiled at a time, and PROFILE_LIMIT per minute from a
+token bucket holding as many, in each process (0, the default, turns
+profiling off). Nothing is profiled while no ADMIN_KEYS are configured.
+Requests beyond these limits are served without a profile. Only the
+MAX_PROFILES latest profiles are kept. The body of a streamed response (e.g. an export) is sent after
+the operation returns, and is not part of its profile.
+"""
+
+import os
+import glob
+import uuid
+import pstats
+import cProfile
+import threading
+import functools
+from collections import defaultdict
+
+import flask
+from connexion.resolver import Resolver, Resolution
+
+from candig_dataset_service.api.admission import TokenBuckets
+from candig_dataset_service.api.exceptions import AuthorizationError
+from candig_dataset_service.api.logging import logger, structured_log as struct_log
+from candig_dataset_service.auth import require_admin
+
+MAX_PROFILES = 50
+
+PROFILE_FORMATS = ('collapsed', 'pstats')
+
+_BUCKET = TokenBuckets()
+_PROFILING = threading.Lock()
+
+
+def profile_path(profile_id, profile_format):
+    """
+    File of a profile in PROFILE_DIR
+
+    :param profile_id: id returned in X-Profile-Id, 32 hex digits
+    :param profile_format: one of PROFILE_FORMATS
+    """
+    return os.path.join(flask.current_app.config['PROFILE_DIR'],
+                        '{}.{}'.format(profile_id, profile_format))
+
+
+def _label(func):
+    """Name of a function of pstats, e.g. operations.py:817(search_datasets)"""
+    filename, line, name = func
+    if filename == '~':
+        # built-in
+        return name
+    return '{}:{}({})'.format(os.path.basename(filename), line, name)
+
+
+def collapsed_stacks(stats, min_seconds=1e-6):
+    """
+    Folded stacks of a profile: one 'frame;frame;...;frame microseconds'
+    line per stack
+
+    cProfile records callers and callees rather than whole stacks, so
+    the time of a function called from several places is split between
+    them in proportion to the time spent in each call.
+
+    :param stats: pstats.Stats of a cProfile run
+    :param min_seconds: calls taking less than this are left out
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, seconds) in callers.items():
+            callees[caller][func] = seconds
+
+    folded = defaultdict(float)
+
+    def walk(func, stack, seconds):
+        _, _, own, total, _ = stats.stats[func]
+        stack = stack + (func,)
+        share = seconds / total if total else 0
+        folded[';'.join(_label(frame).replace(';', ':') for frame in stack)] += own * share
+        for callee, callee_seconds in callees[func].items():
+            # recursive calls are already counted in the time of the first
+            if callee not in stack and callee_seconds * share >= min_seconds:
+                walk(callee, stack, callee_seconds * share)
+
+    for func, (_, _, _, total, callers) in stats.stats.items():
+        if not callers:
+            walk(func, (), total)
+    return ''.join('{} {}\n'.format(stack, round(seconds * 1e6))
+                   for stack, seconds in folded.items() if round(seconds * 1e6))
+
+
+def _save(profile_id, profiler):
+    """
+    Write a profile in each of PROFILE_FORMATS, and remove the oldest
+    beyond MAX_PROFILES
+    """
+    directory = flask.current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(profile_path(profile_id, 'pstats'))
+    with open(profile_path(profile_id, 'collapsed'), 'w') as collapsed:
+        collapsed.write(collapsed_stacks(stats))
+
+    saved = sorted(glob.glob(os.path.join(directory, '*.pstats')), key=os.path.getmtime)
+    for path in saved[:-MAX_PROFILES]:
+        for profile_format in PROFILE_FORMATS:
+            try:
+                os.remove(os.path.splitext(path)[0] + '.' + profile_format)
+            except FileNotFoundError:
+                pass
+
+
+def _may_profile(operation_id):
+    """
+    Whether the current request asks for a profile and may have one:
+    sent by an admin key, within PROFILE_LIMIT, with no other request
+    being profiled. Takes the profiling lock when it may.
+    """
+    if flask.request.headers.get('X-Profile', '').lower() not in ('1', 'true'):
+        return False
+    config = flask.current_app.config
+    limit = config.get('PROFILE_LIMIT')
+    if not limit or not config.get('ADMIN_KEYS'):
+        return False
+    try:
+        require_admin()
+    except AuthorizationError:
+        return False
+    if _BUCKET.take('profile', limit / 60, max(1, limit)) or not _PROFILING.acquire(blocking=False):
+        logger().info(struct_log(action='profile_refused', operation=operation_id))
+        return False
+    return True
+
+
+def profile(function, operation_id):
+    """
+    Wrap an operation's function to run it under cProfile when the
+    request asks for it and may be profiled
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _may_profile(operation_id):
+            return function(*args, **kwargs)
+
+        profile_id = uuid.uuid4().hex
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            _PROFILING.release()
+            try:
+                _save(profile_id, profiler)
+                flask.g.profile_id = profile_id
+                logger().info(struct_log(action='profile', operation=operation_id,
+                                         profile_id=profile_id))
+            except OSError as e:
+                logger().warning(struct_log(action='profile_not_saved', operation=operation_id,
+                                            exception=str(e)))
+
+    return wrapper
+
+
+def add_profile_id(response):
+    """
+    after_request hook returning the id of the request's profile in the
+    X-Profile-Id header
+    """
+    profile_id = flask.g.get('profile_id')
+    if profile_id is not None:
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+class ProfilingResolver(Resolver):
+    """
+    Resolver wrapping the functions resolved by another resolver with
+    profile()
+    """
+
+    def __init__(self, resolver):
+        super().__init__()
+        self.resolver = resolver
+
+    def resolve(self, operation):
+        resolution = self.resolver.resolve(operation)
+        return Resolution(profile(resolution.function, resolution.operation_id),
+                          resolution.operation_id)
@@ -0,0 +1,76 @@
+"""
+JSON serialization of API responses and log entries
+
+dumps() uses orjson, and the stdlib json module when orjson cannot be
+imported; both write compact JSON, UUIDs as strings and datetimes as
+ISO 8601, with naive datetimes taken as UTC (e.g.
+``2015-09-25T23:14:42.588601Z``), as connexion's encoder does.
+
+install_json_encoder() makes the Flask app, and connexion through it,
+use dumps() for response bodies.
+"""
+
+import json
+import uuid
+import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+_UTC_OFFSET = datetime.timedelta(0)
+
+
+def _stdlib_default(value, default=None):
+    """UUID and datetime support for the stdlib encoder, matching orjson"""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None or value.utcoffset() == _UTC_OFFSET:
+            return value.replace(tzinfo=None).isoformat() + 'Z'
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if default is not None:
+        return default(value)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def dumps(obj, default=None):
+    """
+    Compact JSON text of obj
+
+    :param default: function returning a serializable version of
+        objects of other types; TypeError is raised for them without it
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'),
+                      default=lambda value: _stdlib_default(value, default))
+
+
+def loads(value):
+    """Parse JSON text or bytes"""
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+class JSONEncoder(json.JSONEncoder):
+    """
+    json.JSONEncoder delegating to dumps(); formatting arguments such as
+    indent are ignored
+    """
+
+    def encode(self, o):
+        return dumps(o)
+
+
+def install_json_encoder(flask_app):
+    """
+    Serialize the JSON bodies of flask_app with dumps()
+    """
+    flask_app.json_encoder = JSONEncoder
@@ -0,0 +1,170 @@
+"""
+Request and response validation against the OpenAPI spec
+
+Request bodies are validated by functions generated once per operation
+with fastjsonschema instead of walking the schema
+with jsonschema for every request.
+
+RESPONSE_VALIDATION in the app config selects how responses are checked
+against the OpenAPI spec:
+
+- ``always`` (used by the tests): every response is validated and a
+  non-conforming one becomes a 500
+- ``sampled`` (the default): RESPONSE_VALIDATION_SAMPLE percent of
+  responses, 1 by default, are validated; violations are logged and
+  counted, and the response is sent unchanged
+- ``off``: responses are not validated
+"""
+
+import copy
+import uuid
+import random
+import functools
+
+import fastjsonschema
+from flask import current_app
+from prometheus_client import Counter
+from jsonschema import draft4_format_checker
+from connexion.decorators.response import ResponseValidator
+from connexion.decorators.validation import RequestBodyValidator
+from connexion.exceptions import NonConformingResponse
+from connexion.json_schema import Draft4RequestValidator
+
+from candig_dataset_service.api.logging import logger
+from candig_dataset_service.api.logging import structured_log as struct_log
+
+RESPONSE_VALIDATION_MODES = ('always', 'sampled', 'off')
+DEFAULT_RESPONSE_VALIDATION = 'sampled'
+
+RESPONSE_VIOLATIONS = Counter('dataset_service_response_validation_failures_total',
+                              'Sampled responses not conforming to the API spec',
+                              ['operation', 'status'])
+
+
+def is_uuid(value):
+    """The uuid string format, as accepted by the GUID column type"""
+    try:
+        uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return True
+
+
+# jsonschema does not know the uuid format; check it on both paths
+FORMAT_CHECKER = copy.deepcopy(draft4_format_checker)
+FORMAT_CHECKER.checks('uuid')(is_uuid)
+
+# OpenAPI keywords without a JSON Schema equivalent the compiled
+# validators could honour; schemas using them stay on jsonschema
+_UNSUPPORTED_KEYWORDS = {'readOnly', 'writeOnly', 'x-writeOnly', 'discriminator', 'x-nullable'}
+
+
+def to_json_schema(schema):
+    """
+    Translate an OpenAPI 3.0 schema, with its references resolved, into
+    draft 4 JSON Schema
+
+    :raises ValueError: if the schema uses keywords that cannot be translated
+    """
+    if isinstance(schema, list):
+        return [to_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    unsupported = _UNSUPPORTED_KEYWORDS.intersection(schema)
+    if unsupported:
+        raise ValueError('Cannot translate ' + ', '.join(sorted(unsupported)))
+
+    translated = {}
+    for key, value in schema.items():
+        if key in ('properties', 'patternProperties', 'definitions'):
+            translated[key] = {name: to_json_schema(sub) for name, sub in value.items()}
+        elif key in ('example', 'xml', 'externalDocs', 'nullable'):
+            continue
+        else:
+            translated[key] = to_json_schema(value)
+
+    if schema.get('nullable'):
+        if 'type' in translated:
+            translated['type'] = [translated['type'], 'null']
+        if 'enum' in translated:
+            translated['enum'] = list(translated['enum']) + [None]
+    return translated
+
+
+def compile_schema(schema):
+    """
+    Validation function generated from an OpenAPI schema, raising
+    fastjsonschema.JsonSchemaException for invalid data
+
+    :return: the function, or None when the schema cannot be compiled
+    """
+    if not schema:
+        return None
+    try:
+        json_schema = dict(to_json_schema(schema), **{'$schema': 'http://json-schema.org/draft-04/schema#'})
+        return fastjsonschema.compile(json_schema, formats={'uuid': is_uuid}, use_default=False)
+    except (ValueError, fastjsonschema.JsonSchemaDefinitionException):
+        return None
+
+
+class CompiledRequestBodyValidator(RequestBodyValidator):
+    """
+    RequestBodyValidator checking bodies with a compiled function; passed
+    to add_api through validator_map. Bodies the function rejects are
+    validated again by jsonschema, which has the final word and keeps the
+    error messages unchanged.
+    """
+
+    def __init__(self, schema, *args, **kwargs):
+        super().__init__(schema, *args, **kwargs)
+        self.validator = (kwargs.get('validator') or Draft4RequestValidator)(
+            schema, format_checker=FORMAT_CHECKER)
+        self.compiled = compile_schema(schema)
+
+    def validate_schema(self, data, url):
+        if self.compiled is None or self.is_null_value_valid:
+            return super().validate_schema(data, url)
+        try:
+            self.compiled(data)
+        except fastjsonschema.JsonSchemaException:
+            return super().validate_schema(data, url)
+        return None
+
+
+class SampledResponseValidator(ResponseValidator):
+    """
+    ResponseValidator honouring the RESPONSE_VALIDATION mode; passed to
+    add_api through validator_map
+    """
+
+    def __call__(self, function):
+        validated = super().__call__(function)
+
+        @functools.wraps(function)
+        def wrapper(request):
+            config = current_app.config
+            mode = config.get('RESPONSE_VALIDATION', DEFAULT_RESPONSE_VALIDATION)
+            if mode == 'off':
+                return function(request)
+            if mode == 'sampled' and \
+                    random.random() * 100 >= config.get('RESPONSE_VALIDATION_SAMPLE', 1):
+                return function(request)
+            return validated(request)
+
+        return wrapper
+
+    def validate_response(self, data, status_code, headers, url):
+        try:
+            return super().validate_response(data, status_code, headers, url)
+        except NonConformingResponse as e:
+            mode = current_app.config.get('RESPONSE_VALIDATION', DEFAULT_RESPONSE_VALIDATION)
+            if mode != 'sampled':
+                raise
+            RESPONSE_VIOLATIONS.labels(operation=self.operation.operation_id,
+                                       status=str(status_code)).inc()
+            logger().warning(struct_log(action='response does not conform to the API spec',
+                                        operation=self.operation.operation_id,
+                                        status_code=status_code, url=url, reason=e.reason,
+                                        detail=e.message))
+            return True
@@ -6,6 +6,7 @@ import flask
 
 from candig_dataset_service.api.logging import structured_log as struct_log
 from candig_dataset_service.api.logging import logger
+from candig_dataset_service.api.exceptions import AuthorizationError
 
 
 def _report_proxy_auth_error(key, **kwargs):
@@ -29,4 +30,21 @@ def auth_key(api_key, required_scopes=None):
             return None
     # For now, any api_key to local app should work
     # TODO: refine auth methods
-    return {}
\ No newline at end of file
+    return {}
+
+
+def require_admin():
+    """
+    Raise AuthorizationError unless the API key of the current request
+    is one of the configured ADMIN_KEYS. Admin endpoints are closed to
+    every key while ADMIN_KEYS is unset.
+
+    Calls made outside of a request (e.g. the admin CLI) are trusted.
+    """
+    if not flask.has_request_context():
+        return
+    admin_keys = flask.current_app.config.get('ADMIN_KEYS') or ()
+    api_key = flask.request.headers.get('Authorization')
+    if api_key not in admin_keys:
+        _report_proxy_auth_error(str(api_key), path=flask.request.path)
+        raise AuthorizationError()
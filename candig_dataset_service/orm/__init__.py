@@ -2,12 +2,19 @@
 ORM module for service
 """
 import os
+import random
 import warnings
-from sqlalchemy import event, create_engine, exc
+from sqlalchemy import event, create_engine, exc, inspect, text
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.orm import scoped_session, sessionmaker, Session
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from tornado.options import options
+from candig_dataset_service.orm.writer import GroupCommitWriter
+from candig_dataset_service.orm.guid import GUID, GUID_STORAGES, encode_guid
+from candig_dataset_service.orm import codec
+from candig_dataset_service.orm.instrumentation import instrument_engine
 
 ORMException = SQLAlchemyError
 
@@ -15,6 +22,9 @@ Base = declarative_base()
 
 _ENGINE = None
 _DB_SESSION = None
+_WRITER = None
+_REPLICAS = []
+_READ_SESSION = None
 
 
 # From http://docs.sqlalchemy.org/en/latest/faq/connections.html
@@ -47,16 +57,244 @@ def add_engine_pidguard(engine):
             )
 
 
-def init_db(uri=None):
+def add_sqlite_pragmas(engine, pragmas):
+    """Apply PRAGMA settings to every new SQLite connection,
+    e.g. {'journal_mode': 'WAL', 'busy_timeout': 5000}
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, _connection_record):  # pylint:disable=unused-variable
+        """Run the pragmas at connect time"""
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+
+
+def add_read_only_guard(engine):
+    """Make every connection read-only, for workers that only serve reads"""
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, _connection_record):  # pylint:disable=unused-variable
+        """Switch the connection to read-only at connect time"""
+        cursor = dbapi_connection.cursor()
+        if engine.dialect.name == 'sqlite':
+            cursor.execute('PRAGMA query_only = ON')
+        elif engine.dialect.name == 'postgresql':
+            cursor.execute('SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY')
+        cursor.close()
+
+
+def _create_engine(uri, pragmas=None, read_only=False, json_codec='auto', **engine_options):
+    """
+    Create and instrument one engine; see init_db for the parameters
+    """
+    if uri.startswith('sqlite') and 'pool_size' in engine_options:
+        # file-based SQLite defaults to NullPool, i.e. a cold connection per
+        # checkout; keep connections open instead. The pool guarantees a
+        # connection is only used by one thread at a time.
+        engine_options.setdefault('poolclass', QueuePool)
+        connect_args = dict(engine_options.get('connect_args', {}), check_same_thread=False)
+        engine_options['connect_args'] = connect_args
+
+    json_encoder = codec.get_encoder(json_codec)
+    if uri.startswith('postgresql') and codec.orjson is not None and json_codec != 'json':
+        # JSONB values are (de)serialized by the driver
+        engine_options.setdefault('json_serializer', codec.encode_orjson)
+        engine_options.setdefault('json_deserializer', codec.loads)
+
+    engine = create_engine(uri, convert_unicode=True, **engine_options)
+    engine.dialect.json_encoder = json_encoder
+    add_engine_pidguard(engine)
+    instrument_engine(engine)
+    if pragmas and engine.dialect.name == 'sqlite':
+        add_sqlite_pragmas(engine, pragmas)
+    if read_only:
+        add_read_only_guard(engine)
+    return engine
+
+
+def init_db(uri=None, write_batch_window=0, pragmas=None, read_only=False,
+            guid_storage='binary', json_codec='auto', replica_uris=None, **engine_options):
     """
     Creates the DB engine + ORM
+
+    :param uri: database URI, defaults to the sqlite file in options.dbfile
+    :param write_batch_window: if > 0, seconds over which inserts are
+        grouped into one transaction by a GroupCommitWriter
+    :param pragmas: dict of PRAGMA settings applied to each SQLite connection
+    :param read_only: open connections read-only; the schema is then
+        neither created nor migrated
+    :param guid_storage: 'binary' or 'hex' storage of GUIDs in a new
+        database; existing databases keep the storage they were created
+        with until converted by migrate_guid_storage()
+    :param json_codec: codec writing the JsonArray columns: 'json',
+        'orjson', 'msgpack', or 'auto' for orjson when installed
+    :param replica_uris: URIs of read replicas (or read-only copies of a
+        SQLite file) serving get_read_session(); opened read-only
+    :param engine_options: passed to create_engine, e.g. pool_size,
+        pool_recycle, pool_pre_ping
     """
-    global _ENGINE
+    global _ENGINE, _WRITER, _REPLICAS, _READ_SESSION
     if not uri:
         uri = 'sqlite:///' + options.dbfile
-    _ENGINE = create_engine(uri, convert_unicode=True)
-    add_engine_pidguard(_ENGINE)
-    Base.metadata.create_all(bind=_ENGINE)
+    # the previous writer commits what it was given through the old engine
+    if _WRITER is not None:
+        _WRITER.stop()
+    for engine in [_ENGINE] + _REPLICAS:
+        if engine is not None:
+            engine.dispose()
+
+    _ENGINE = _create_engine(uri, pragmas, read_only, json_codec, **dict(engine_options))
+    _ENGINE.dialect.guid_storage = detect_guid_storage(_ENGINE) or guid_storage
+    if not read_only:
+        Base.metadata.create_all(bind=_ENGINE)
+        add_missing_columns(_ENGINE)
+
+    _REPLICAS = []
+    for replica_uri in replica_uris or []:
+        replica = _create_engine(replica_uri, pragmas, True, json_codec, **dict(engine_options))
+        replica.dialect.guid_storage = detect_guid_storage(replica) or _ENGINE.dialect.guid_storage
+        _REPLICAS.append(replica)
+
+    if _DB_SESSION is not None:
+        _DB_SESSION.remove()
+        _DB_SESSION.configure(bind=_ENGINE)
+    if _READ_SESSION is not None:
+        _READ_SESSION.remove()
+    _READ_SESSION = None
+    if _REPLICAS:
+        # each session, i.e. each request, reads from one replica at random
+        _READ_SESSION = scoped_session(lambda: Session(bind=random.choice(_REPLICAS),
+                                                       autocommit=False, autoflush=False))
+
+    _WRITER = None
+    if write_batch_window > 0:
+        _WRITER = GroupCommitWriter(sessionmaker(bind=_ENGINE), window=write_batch_window)
+
+
+def add_missing_columns(engine):
+    """
+    Bring tables created by an older release up to date by adding
+    any mapped columns they are missing. create_all() only creates
+    absent tables, so new columns need an explicit ALTER TABLE.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(table.name, ddl))
+
+
+def _guid_columns():
+    """(table, column) pairs of every GUID column"""
+    return [(table, column) for table in Base.metadata.sorted_tables
+            for column in table.columns if isinstance(column.type, GUID)]
+
+
+def detect_guid_storage(engine):
+    """
+    GUID storage used by an existing database: 'binary', 'hex', or None
+    if it does not hold any GUID yet (or stores them as native UUIDs)
+    """
+    if engine.dialect.name == 'postgresql':
+        return None
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    for table, column in _guid_columns():
+        if table.name not in tables:
+            continue
+        if engine.dialect.name == 'sqlite':
+            # SQLite stores any value in any column, so look at a row
+            # rather than at the declared type
+            stored = engine.execute(text('SELECT typeof({}) FROM {} LIMIT 1'.format(
+                column.name, table.name))).scalar()
+            if stored is not None:
+                return 'binary' if stored == 'blob' else 'hex'
+        else:
+            for existing in inspector.get_columns(table.name):
+                if existing['name'] == column.name:
+                    return 'hex' if existing['type'].python_type is str else 'binary'
+    return None
+
+
+def migrate_guid_storage(engine, storage, batch_size=1000):
+    """
+    Convert the stored GUIDs of a SQLite database to the given storage,
+    then VACUUM it to rebuild the primary key indexes at their new size.
+    Rows already in the target storage are left alone, so an interrupted
+    migration can simply be run again. Services using the database must
+    be restarted afterwards.
+
+    :param engine: SQLAlchemy engine of the database
+    :param storage: 'binary' or 'hex'
+    :param batch_size: number of rows updated per statement
+    :return: number of values converted
+    """
+    if storage not in GUID_STORAGES:
+        raise ValueError('GUID storage must be one of ' + ', '.join(GUID_STORAGES))
+    if engine.dialect.name != 'sqlite':
+        raise ValueError('GUID storage can only be migrated on SQLite, '
+                         'PostgreSQL stores GUIDs as native UUIDs')
+
+    stored_type = 'blob' if storage == 'binary' else 'text'
+    tables = set(inspect(engine).get_table_names())
+    converted = 0
+    with engine.begin() as conn:
+        for table, column in _guid_columns():
+            if table.name not in tables:
+                continue
+            values = [row[0] for row in conn.execute(text(
+                'SELECT {col} FROM {table} WHERE {col} IS NOT NULL '
+                'AND typeof({col}) != :stored'.format(col=column.name, table=table.name)),
+                stored=stored_type)]
+            update = text('UPDATE {table} SET {col} = :new WHERE {col} = :old'.format(
+                col=column.name, table=table.name))
+            for start in range(0, len(values), batch_size):
+                conn.execute(update, [{'old': value, 'new': encode_guid(value, storage)}
+                                      for value in values[start:start + batch_size]])
+            converted += len(values)
+
+    if converted:
+        engine.execute(text('VACUUM'))
+    engine.dialect.guid_storage = storage
+    return converted
+
+
+def dispose_engines():
+    """
+    Close every pooled connection and release the sessions of this
+    thread. Call in a preforking server's master once the app has been
+    loaded, so that workers do not inherit open connections.
+    """
+    if _DB_SESSION is not None:
+        _DB_SESSION.remove()
+    remove_read_session()
+    for engine in [_ENGINE] + _REPLICAS:
+        if engine is not None:
+            engine.dispose()
+
+
+def prewarm_pools():
+    """
+    Open each engine's pool_size connections up front, running the
+    connect-time setup (pragmas, read-only guard) before the first
+    request. Call in each worker right after fork. Engines without a
+    connection pool (e.g. default file-based SQLite) are left alone.
+    """
+    for engine in [_ENGINE] + _REPLICAS:
+        if engine is None or not hasattr(engine.pool, 'size'):
+            continue
+        connections = []
+        try:
+            for _ in range(engine.pool.size()):
+                connection = engine.connect()
+                connection.execute(text('SELECT 1'))
+                connections.append(connection)
+        finally:
+            for connection in connections:
+                connection.close()
 
 
 def get_session(**kwargs):
@@ -72,6 +310,46 @@ def get_session(**kwargs):
     return _DB_SESSION
 
 
+def get_read_session(primary=False):
+    """
+    Session for read-only work: bound to a replica when replicas are
+    configured, otherwise (or when primary is set, e.g. to read a
+    client's own recent writes) the primary session
+    """
+    if primary or _READ_SESSION is None:
+        return get_session()
+    return _READ_SESSION
+
+
+def remove_read_session():
+    """
+    Release the replica session of the current thread, if any
+    """
+    if _READ_SESSION is not None:
+        _READ_SESSION.remove()
+
+
+def get_replicas():
+    """
+    The read replica engines created by init_db()
+    """
+    return _REPLICAS
+
+
+def get_engine():
+    """
+    The DB engine created by init_db()
+    """
+    return _ENGINE
+
+
+def get_writer():
+    """
+    The group-commit writer, or None when inserts commit directly
+    """
+    return _WRITER
+
+
 def close_session():
     """
     Close the database session
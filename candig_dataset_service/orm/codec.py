@@ -0,0 +1,89 @@
+"""
+Encodings for the JsonArray columns
+
+Values are written with the codec configured for the engine: stdlib json,
+orjson, or msgpack. Reading does not depend on that setting: msgpack
+values carry a versioned header, anything else is JSON text, so rows
+written under any codec (or by an older release) decode alike.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 0xc1 is never used by msgpack and cannot start JSON text, so it marks a
+# binary value; the byte after it is the version of the binary format
+BINARY_MARKER = 0xc1
+MSGPACK_V1 = 1
+
+CODECS = ('auto', 'json', 'orjson', 'msgpack')
+
+
+def encode_json(value):
+    """Encode with the stdlib, matching the rows of older releases"""
+    return json.dumps(value)
+
+
+def encode_orjson(value):
+    """Encode as compact JSON text with orjson"""
+    return orjson.dumps(value).decode('utf-8')
+
+
+def encode_msgpack(value):
+    """Encode as msgpack, behind the binary marker and version"""
+    return bytes((BINARY_MARKER, MSGPACK_V1)) + msgpack.packb(value, use_bin_type=True)
+
+
+def loads(value):
+    """Parse JSON text, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+def decode(value):
+    """
+    Decode a stored value, whichever codec wrote it
+
+    :param value: str or bytes from the database
+    """
+    if isinstance(value, memoryview):
+        value = bytes(value)
+    if isinstance(value, bytes) and value[:1] == bytes((BINARY_MARKER,)):
+        version = value[1]
+        if version != MSGPACK_V1:
+            raise ValueError('Unknown binary encoding version {}'.format(version))
+        if msgpack is None:
+            raise ValueError('msgpack must be installed to read msgpack-encoded values')
+        return msgpack.unpackb(value[2:], raw=False)
+    return loads(value)
+
+
+def get_encoder(name='auto'):
+    """
+    Encoder function for a codec name
+
+    :param name: 'json', 'orjson', 'msgpack', or 'auto' for orjson when
+        installed and json otherwise
+    """
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'json':
+        return encode_json
+    if name == 'orjson':
+        if orjson is None:
+            raise ValueError('The orjson codec requires the orjson package')
+        return encode_orjson
+    if name == 'msgpack':
+        if msgpack is None:
+            raise ValueError('The msgpack codec requires the msgpack package')
+        return encode_msgpack
+    raise ValueError('Codec must be one of ' + ', '.join(CODECS))
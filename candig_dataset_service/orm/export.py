@@ -0,0 +1,194 @@
+"""
+Point-in-time export of the dataset catalog as NDJSON
+
+Every line is a JSON object ``{"type": ..., "data": ...}``: first the
+datasets, then the change logs, and finally a manifest line holding the
+record counts and a SHA-256 checksum of the lines of each type. All rows
+are read from one snapshot, so the export is consistent even while
+writes continue, and rows are fetched in chunks so memory use does not
+grow with the size of the catalog.
+
+On PostgreSQL, and on SQLite in WAL mode, the snapshot is a read
+transaction. In SQLite's other journal modes a read transaction would
+block writers for as long as the export is being downloaded, so the
+database is first copied to a temporary file, which takes as much disk
+space as the database, and the export is read from the copy.
+"""
+
+import os
+import json
+import uuid
+import zlib
+import sqlite3
+import hashlib
+import datetime
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, select, or_
+
+from candig_dataset_service.orm.guid import guid_storage
+from candig_dataset_service.orm.models import Dataset, ChangeLog
+
+EXPORT_FORMAT = 1
+
+
+@contextmanager
+def snapshot_connection(engine):
+    """
+    Connection reading a single snapshot of the database for its whole
+    lifetime, without holding up writers
+    """
+    if engine.dialect.name == 'sqlite' and _journal_mode(engine) != 'wal':
+        with _sqlite_copy(engine) as copy:
+            with _read_transaction(copy) as conn:
+                yield conn
+    else:
+        with _read_transaction(engine) as conn:
+            yield conn
+
+
+@contextmanager
+def _read_transaction(engine):
+    """
+    Connection holding a single read transaction for its whole lifetime
+    """
+    conn = engine.connect()
+    try:
+        if conn.dialect.name == 'sqlite':
+            # pysqlite defers BEGIN until the first write; start the
+            # transaction explicitly so every SELECT reads the same snapshot.
+            # In WAL mode this does not block writers.
+            conn.execute('BEGIN')
+            yield conn.execution_options(stream_results=True)
+        else:
+            conn = conn.execution_options(isolation_level='REPEATABLE READ',
+                                          stream_results=True)
+            with conn.begin():
+                yield conn
+    finally:
+        conn.close()
+
+
+def _journal_mode(engine):
+    """SQLite journal mode of the engine's database"""
+    with engine.connect() as conn:
+        return conn.execute('PRAGMA journal_mode').scalar().lower()
+
+
+@contextmanager
+def _sqlite_copy(engine):
+    """
+    Engine on a temporary copy of a SQLite database. Outside of WAL mode
+    a read transaction blocks every writer until it ends, i.e. for the
+    whole download of an export; the copy is made with the backup API,
+    which only holds the read lock while the pages are copied.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = sqlite3.connect(os.path.join(tmp, 'snapshot.db'))
+        source = engine.raw_connection()
+        try:
+            source.connection.backup(copy)
+        finally:
+            source.close()
+            copy.close()
+
+        copy_engine = create_engine('sqlite:///' + os.path.join(tmp, 'snapshot.db'))
+        copy_engine.dialect.guid_storage = guid_storage(engine.dialect)
+        try:
+            yield copy_engine
+        finally:
+            copy_engine.dispose()
+
+
+def parse_timestamp(value):
+    """
+    Parse an ISO 8601 date-time, e.g. the since of an export, into a
+    naive UTC datetime
+
+    :raises ValueError: if the value is not a date-time
+    """
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _encode(value):
+    """JSON encoding for the non-JSON column types"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    raise TypeError('Cannot export value of type ' + type(value).__name__)
+
+
+def export_lines(engine, since=None, chunk_size=500, manifest=None):
+    """
+    Generate the NDJSON lines of a catalog export
+
+    :param engine: SQLAlchemy engine to read from
+    :param since: only export datasets created or updated, and change logs
+        created, at or after this datetime
+    :param chunk_size: number of rows fetched from the cursor at a time
+    :param manifest: optional dict, updated with the manifest once the
+        last line has been generated
+    :return: generator of newline-terminated bytes
+    """
+    queries = [('dataset', Dataset.__table__), ('changelog', ChangeLog.__table__)]
+    counts = {}
+    checksums = {}
+
+    with snapshot_connection(engine) as conn:
+        snapshot = datetime.datetime.utcnow()
+
+        for record_type, table in queries:
+            query = select([table])
+            if since is not None:
+                if 'updated' in table.c:
+                    query = query.where(or_(table.c.created >= since, table.c.updated >= since))
+                else:
+                    query = query.where(table.c.created >= since)
+
+            counts[record_type] = 0
+            digest = hashlib.sha256()
+            result = conn.execute(query)
+            rows = result.fetchmany(chunk_size)
+            while rows:
+                for row in rows:
+                    line = json.dumps({'type': record_type, 'data': dict(row)},
+                                      default=_encode, sort_keys=True).encode('utf-8') + b'\n'
+                    digest.update(line)
+                    counts[record_type] += 1
+                    yield line
+                rows = result.fetchmany(chunk_size)
+            checksums[record_type] = digest.hexdigest()
+
+    summary = {
+        'format': EXPORT_FORMAT,
+        'snapshot': snapshot.isoformat(),
+        'since': since.isoformat() if since else None,
+        'counts': counts,
+        'sha256': checksums,
+    }
+    if manifest is not None:
+        manifest.update(summary)
+    yield json.dumps({'type': 'manifest', 'data': summary}, sort_keys=True).encode('utf-8') + b'\n'
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Gzip-compress a stream of bytes chunks incrementally
+
+    :param chunks: iterable of bytes
+    :param level: zlib compression level
+    :return: generator of compressed bytes
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
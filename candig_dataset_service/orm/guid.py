@@ -3,42 +3,76 @@ UUIDs for the database - from SQLAlchemy docs
 """
 import uuid
 
-from sqlalchemy import TypeDecorator, CHAR
+from sqlalchemy import TypeDecorator, CHAR, BINARY, LargeBinary
 from sqlalchemy.dialects.postgresql import UUID
 
+GUID_STORAGES = ('binary', 'hex')
+
 
 class GUID(TypeDecorator):
     """Platform-independent GUID type.
-    Uses Postgresql's UUID type, otherwise uses
-    CHAR(32), storing as stringified hex values.
+    Uses Postgresql's UUID type, otherwise the storage chosen for the
+    engine in ``dialect.guid_storage``: 16 raw bytes ('binary', the
+    default) or CHAR(32) stringified hex values ('hex', the original
+    layout). Values are returned as hex strings either way.
     from SQLAlchemy Docs
     http://docs.sqlalchemy.org/en/rel_0_9/core/custom_types.html
     """
     impl = CHAR
 
     def load_dialect_impl(self, dialect):
-        """Dialect-specific implementation; use UUIDs for Postgres, otherwise CHAR"""
+        """Dialect-specific implementation; use UUIDs for Postgres, otherwise BLOB or CHAR"""
         if dialect.name == 'postgresql':
             return dialect.type_descriptor(UUID())
-        else:
-            return dialect.type_descriptor(CHAR(32))
+        if guid_storage(dialect) == 'binary':
+            if dialect.name == 'sqlite':
+                return dialect.type_descriptor(LargeBinary())
+            return dialect.type_descriptor(BINARY(16))
+        return dialect.type_descriptor(CHAR(32))
 
     def process_bind_param(self, value, dialect):
         """Process the value and return"""
         if value is None:
             return value
-        elif dialect.name == 'postgresql':
+        if dialect.name == 'postgresql':
             return str(value)
+        if isinstance(value, uuid.UUID):
+            raw = value.bytes
+        elif len(value) == 32:
+            # already hex, as returned by process_result_value; fromhex
+            # validates it without building a UUID
+            raw = bytes.fromhex(value)
         else:
-            if not isinstance(value, uuid.UUID):
-                return "%.32x" % uuid.UUID(value).int
-            else:
-                # hexstring
-                return "%.32x" % value.int
+            raw = uuid.UUID(value).bytes
+        if guid_storage(dialect) == 'binary':
+            return raw
+        return raw.hex()
 
     def process_result_value(self, value, dialect):
         """Process provided value"""
         if value is None:
             return value
-        else:
-            return uuid.UUID(value).hex
+        if isinstance(value, bytes):
+            return value.hex()
+        if isinstance(value, uuid.UUID):
+            return value.hex
+        return value.replace('-', '').lower()
+
+
+def guid_storage(dialect):
+    """GUID storage of the engine the dialect belongs to"""
+    return getattr(dialect, 'guid_storage', 'binary')
+
+
+def encode_guid(value, storage):
+    """
+    Convert a stored GUID value to the given storage
+
+    :param value: stored value, 16 bytes or a 32 character hex string
+    :param storage: 'binary' or 'hex'
+    """
+    if isinstance(value, (bytes, memoryview)):
+        raw = bytes(value)
+    else:
+        raw = bytes.fromhex(value)
+    return raw if storage == 'binary' else raw.hex()
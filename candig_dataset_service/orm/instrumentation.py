@@ -0,0 +1,248 @@
+"""
+Accounting of the queries run by the database engines
+
+instrument_engine() makes an engine add each query it runs, with its
+time and the rows fetched from it, to the QueryStats of every
+collect_queries() block open in the current thread, e.g. one per API
+request.
+
+Statements taking longer than SLOW_QUERIES.threshold are also kept in
+SLOW_QUERIES, grouped by fingerprint (the statement with its literals,
+placeholders and IN lists normalized), with the plan of the first one.
+"""
+
+import re
+import time
+import hashlib
+import threading
+import contextlib
+
+from sqlalchemy import event
+
+
+class QueryStats:
+    """
+    Queries run within a collect_queries() block
+    """
+
+    def __init__(self, record=False):
+        """
+        :param record: keep the SQL of each query in statements
+        """
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements = [] if record else None
+        # (SlowQuery, statement, parameters, seconds) of each slow statement
+        self.slow = []
+
+
+class SlowQuery:
+    """
+    Slow statements sharing a fingerprint
+    """
+
+    def __init__(self, fingerprint, statement):
+        """
+        :param fingerprint: hash of the normalized statement
+        :param statement: the normalized statement
+        """
+        self.fingerprint = fingerprint
+        self.statement = statement
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.plan = None
+
+    def as_dict(self):
+        """Summary of the statements, times in milliseconds"""
+        return dict(fingerprint=self.fingerprint, statement=self.statement, count=self.count,
+                    total_ms=round(self.seconds * 1000, 3),
+                    mean_ms=round(self.seconds * 1000 / max(self.count, 1), 3),
+                    max_ms=round(self.max_seconds * 1000, 3), plan=self.plan)
+
+
+_NORMALIZE = [
+    (re.compile(r'\s+'), ' '),
+    # string and number literals, and the qmark or pyformat placeholders
+    (re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|\b\d+(?:\.\d+)?\b"), '?'),
+    # IN lists and PostgreSQL ARRAY[] of any length
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\[\s*\?(?:\s*,\s*\?)*\s*\]'), '[...]'),
+]
+
+# statements run with a plan
+_EXPLAINED = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def normalize_statement(statement):
+    """
+    statement with its literals and placeholders replaced by ?, and
+    lists of them by (...) or [...]
+    """
+    for pattern, replacement in _NORMALIZE:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def explain(engine, statement, parameters):
+    """
+    Plan of a statement, from EXPLAIN QUERY PLAN on SQLite or EXPLAIN
+    otherwise, on a connection of its own
+
+    :return: lines of the plan, or None for statements not planned
+        (e.g. PRAGMA or COMMIT)
+    """
+    words = statement.split(None, 1)
+    if not words or words[0].upper() not in _EXPLAINED:
+        return None
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(prefix + statement, parameters)
+        # the plan is in the last column: the detail of each SQLite step,
+        # the only column on PostgreSQL
+        return [str(row[-1]) for row in cursor.fetchall()]
+    except engine.dialect.dbapi.Error as e:
+        return ['EXPLAIN failed: {}'.format(e)]
+    finally:
+        # returned to the pool, which rolls it back
+        connection.close()
+
+
+class SlowQueryLog:
+    """
+    Statements taking threshold seconds or more, by fingerprint
+    """
+
+    def __init__(self, threshold=None, max_fingerprints=500):
+        """
+        :param threshold: seconds from which a statement is slow; None
+            or 0 keeps none
+        :param max_fingerprints: fingerprints kept; the one with the
+            least total time is dropped for a new one
+        """
+        self.threshold = threshold
+        self.max_fingerprints = max_fingerprints
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, engine, statement, parameters, seconds):
+        """
+        Add a slow statement. The plan is captured for the first
+        statement of each fingerprint.
+
+        :return: the SlowQuery of its fingerprint
+        """
+        normalized = normalize_statement(statement)
+        fingerprint = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            query = self._queries.get(fingerprint)
+            new = query is None
+            if new:
+                if len(self._queries) >= self.max_fingerprints:
+                    del self._queries[min(self._queries, key=lambda key: self._queries[key].seconds)]
+                query = self._queries[fingerprint] = SlowQuery(fingerprint, normalized)
+            query.count += 1
+            query.seconds += seconds
+            query.max_seconds = max(query.max_seconds, seconds)
+        if new:
+            query.plan = explain(engine, statement, parameters)
+        return query
+
+    def top(self, limit=20):
+        """
+        :return: the SlowQuery of the limit fingerprints with the most
+            total time, most first
+        """
+        with self._lock:
+            queries = list(self._queries.values())
+        return sorted(queries, key=lambda query: query.seconds, reverse=True)[:limit]
+
+    def clear(self):
+        """Forget the slow statements seen so far"""
+        with self._lock:
+            self._queries.clear()
+
+
+SLOW_QUERIES = SlowQueryLog()
+
+
+_COLLECTING = threading.local()
+
+
+def _collecting():
+    """QueryStats of the blocks open in this thread"""
+    return getattr(_COLLECTING, 'stats', ())
+
+
+@contextlib.contextmanager
+def collect_queries(record=False):
+    """
+    Count the queries run in this thread within the block; blocks may
+    be nested
+
+    :param record: keep the SQL of each query
+    :return: the QueryStats, updated until the block exits
+    """
+    stats = QueryStats(record)
+    _COLLECTING.stats = _collecting() + (stats,)
+    try:
+        yield stats
+    finally:
+        _COLLECTING.stats = tuple(other for other in _collecting() if other is not stats)
+
+
+def instrument_engine(engine):
+    """
+    Report the queries of engine to collect_queries() and SLOW_QUERIES
+    """
+    # a connection runs one statement at a time; a start time left by a
+    # statement that failed is overwritten by the next one
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, *_args):  # pylint:disable=unused-variable
+        conn.info['query_start_time'] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, _cursor, statement, parameters,  # pylint:disable=unused-variable
+                             _context, executemany):
+        start = conn.info.pop('query_start_time', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        slow = None
+        if SLOW_QUERIES.threshold and elapsed >= SLOW_QUERIES.threshold:
+            if executemany:
+                parameters = parameters[0]
+            slow = (SLOW_QUERIES.observe(engine, statement, parameters, elapsed),
+                    statement, parameters, elapsed)
+        for stats in _collecting():
+            stats.count += 1
+            stats.seconds += elapsed
+            if stats.statements is not None:
+                stats.statements.append(statement)
+            if slow is not None:
+                stats.slow.append(slow)
+
+    # SELECTs do not report their row count on every driver (SQLite
+    # reports -1), so rows are counted as they are fetched instead
+    class CountingExecutionContext(engine.dialect.execution_ctx_cls):
+        """Execution context counting the rows fetched from its results"""
+
+        def get_result_proxy(self):
+            result = super().get_result_proxy()
+            collecting = _collecting()
+            if collecting:
+                process_rows = result.process_rows
+
+                def count_rows(rows):
+                    rows = process_rows(rows)
+                    for stats in collecting:
+                        stats.rows += len(rows)
+                    return rows
+
+                result.process_rows = count_rows
+            return result
+
+    engine.dialect.execution_ctx_cls = CountingExecutionContext
@@ -2,28 +2,52 @@
 SQLAlchemy models for database
 """
 
-from sqlalchemy import Column, String, DateTime
+from sqlalchemy import Column, String, DateTime, Integer, DDL, event, text
 from sqlalchemy import TypeDecorator
+from sqlalchemy.orm import deferred
+from sqlalchemy.dialects.postgresql import JSONB
 from candig_dataset_service.orm.guid import GUID
 from candig_dataset_service.orm import Base
-import json
+from candig_dataset_service.orm.codec import decode, encode_json
 
 
 class JsonArray(TypeDecorator):
     """
-    Custom array type to emulate arrays in sqlite3
+    Custom array type to emulate arrays in sqlite3.
+    Uses JSONB on Postgres, so that the contents can be indexed and
+    queried with the JSON operators.
+
+    Elsewhere values are written with the engine's codec (see
+    orm.codec). Searchable columns are matched with LIKE on their JSON
+    text, so they are always written as stdlib JSON.
     """
 
     impl = String
 
+    def __init__(self, *args, searchable=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.searchable = searchable
+
+    def load_dialect_impl(self, dialect):
+        """Dialect-specific implementation; use JSONB for Postgres, otherwise String"""
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(self.impl)
+
     def process_bind_param(self, value, dialect):
-        return json.dumps(value)
+        if dialect.name == 'postgresql':
+            return value
+        if self.searchable:
+            return encode_json(value)
+        return getattr(dialect, 'json_encoder', encode_json)(value)
 
     def process_result_value(self, value, dialect):
-        return json.loads(value)
+        if dialect.name == 'postgresql' or value is None:
+            return value
+        return decode(value)
 
     def copy(self):
-        return JsonArray(self.impl.length)
+        return JsonArray(self.impl.length, searchable=self.searchable)
 
 
 class Dataset(Base):
@@ -33,14 +57,63 @@ class Dataset(Base):
     __tablename__ = 'datasets'
     id = Column(GUID(), primary_key=True)
     version = Column(String(10), default="")
-    tags = Column(JsonArray(), default=[])
+    tags = Column(JsonArray(searchable=True), default=[])
     name = Column(String(100), unique=True, nullable=False)
     description = Column(String(100), default="")
     ontologies = Column(JsonArray(), default=[])
-    ontologies_internal = Column(JsonArray(), default=[]) # Shorthand for searching/lookup
+    # Shorthand for searching/lookup; only read when asked for
+    ontologies_internal = deferred(Column(JsonArray(searchable=True), default=[]))
 
     created = Column(DateTime())
+    updated = Column(DateTime())
+
+    # Optimistic concurrency counter; bumped by the ORM on every UPDATE
+    revision = Column(Integer, nullable=False, server_default='1')
     __table_args__ = ()
+    __mapper_args__ = {'version_id_col': revision}
+
+
+# GIN indexes serving the tag (?|) and ontology term (@>) searches on Postgres
+for _ddl in ('CREATE INDEX IF NOT EXISTS ix_datasets_tags ON datasets USING gin (tags)',
+             'CREATE INDEX IF NOT EXISTS ix_datasets_ontologies_internal '
+             'ON datasets USING gin (ontologies_internal jsonb_path_ops)'):
+    event.listen(Dataset.__table__, 'after_create', DDL(_ddl).execute_if(dialect='postgresql'))
+
+
+class DatasetEvent(Base):
+    """
+    SQLAlchemy class for the append-only feed of dataset changes. Each
+    event is written in the transaction making the change, and seq is
+    the cursor consumers resume from.
+    """
+    __tablename__ = 'dataset_events'
+    seq = Column(Integer, primary_key=True)
+    dataset_id = Column(GUID(), nullable=False, index=True)
+    action = Column(String(10), nullable=False)  # created, updated or deleted
+    revision = Column(Integer)
+    created = Column(DateTime(), nullable=False)
+    # never reuse the seq of a pruned event
+    __table_args__ = {'sqlite_autoincrement': True}
+
+
+# Arbitrary key of the Postgres advisory lock serializing event writers
+DATASET_EVENTS_LOCK = 0x64617461
+
+
+def lock_dataset_events(connection):
+    """
+    Serialize the transactions writing events until they commit, so
+    that events become visible in seq order and a consumer's cursor
+    never skips an event committed late. SQLite writers are already
+    serialized by the database lock.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), key=DATASET_EVENTS_LOCK)
+
+
+@event.listens_for(DatasetEvent, 'before_insert')
+def _lock_before_event_insert(_mapper, connection, _target):
+    lock_dataset_events(connection)
 
 
 class ChangeLog(Base):
@@ -62,3 +135,15 @@ class ActiveOntologies(Base):
     name = Column(String(10), primary_key=True)
     terms = Column(JsonArray(), default=[])
 
+
+class IdempotencyKey(Base):
+    """
+    SQLAlchemy class recording the response to a POST made with an
+    Idempotency-Key header, so that retries can be answered from it
+    """
+    __tablename__ = 'idempotency_keys'
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    response = Column(JsonArray())
+    status = Column(Integer, nullable=False)
+    expires = Column(DateTime(), nullable=False, index=True)
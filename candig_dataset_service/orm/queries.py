@@ -0,0 +1,92 @@
+"""
+Query building blocks shared by the API operations and the admin CLI
+"""
+
+import datetime
+
+from sqlalchemy import or_, and_, select, literal, type_coerce, DateTime
+from sqlalchemy.dialects.postgresql import JSONB, array
+
+from candig_dataset_service.orm import get_engine
+from candig_dataset_service.orm.models import Dataset, DatasetEvent, lock_dataset_events
+
+
+def dataset_filters(tags=None, version=None, ontologies=None, dialect=None):
+    """
+    SQL criteria implementing the search_datasets filters
+
+    On Postgres the JSONB columns are matched with the ?| and @> operators,
+    which can use their GIN indexes. Elsewhere they are stored as JSON text
+    and matched with LIKE on the quoted element.
+
+    :param tags: list of tags, any of which must match
+    :param version: version substring to match
+    :param ontologies: list of ontology terms, any of which must match
+    :param dialect: name of the database dialect, defaults to that of the engine
+    :return: list of criteria to pass to Query.filter()
+    """
+    if dialect is None:
+        dialect = get_engine().dialect.name
+
+    criteria = []
+    if version:
+        criteria.append(Dataset.version.like('%' + version + '%'))
+
+    if dialect == 'postgresql':
+        if tags:
+            criteria.append(type_coerce(Dataset.tags, JSONB).has_any(array(list(tags))))
+        if ontologies:
+            # ontologies_internal maps ontology name to terms, e.g. {'duo': [{'id': 'DUO:0000018'}]}
+            internal = type_coerce(Dataset.ontologies_internal, JSONB)
+            criteria.append(or_(*[internal.contains({term.split(':')[0].lower(): [{'id': term}]})
+                                  for term in ontologies]))
+        return criteria
+
+    if tags:
+        # return any project that matches at least one tag
+        criteria.append(or_(*[Dataset.tags.contains(tag) for tag in tags]))
+    if ontologies:
+        criteria.append(or_(*[Dataset.ontologies_internal.contains(term) for term in ontologies]))
+    return criteria
+
+
+def delete_datasets(db_session, criteria, dry_run=False):
+    """
+    Delete every dataset matching the criteria with one set-based
+    DELETE statement, recording a 'deleted' event for each of them with
+    one INSERT ... SELECT. The caller is responsible for committing.
+
+    :param db_session: SQLAlchemy session
+    :param criteria: list of criteria from dataset_filters()
+    :param dry_run: only count the matching datasets
+    :return: number of datasets matched (dry run) or deleted
+    """
+    query = db_session.query(Dataset).filter(*criteria)
+    if dry_run:
+        return query.count()
+
+    lock_dataset_events(db_session.connection())
+    matching = select([Dataset.id, literal('deleted'), Dataset.revision,
+                       literal(datetime.datetime.utcnow(), DateTime())]).where(and_(*criteria))
+    db_session.execute(DatasetEvent.__table__.insert().from_select(
+        ['dataset_id', 'action', 'revision', 'created'], matching))
+    return query.delete(synchronize_session=False)
+
+
+def in_chunks(query, column, values, chunk_size=500):
+    """
+    Rows of query whose column is one of values, fetched with one
+    ``column IN (...)`` query per chunk_size values, which keeps each
+    query within the bound parameter limit of the database (999 for
+    SQLite before 3.32)
+
+    :param query: SQLAlchemy query to filter
+    :param column: column matched against the values
+    :param values: list of values
+    :param chunk_size: values per query
+    :return: list of rows
+    """
+    rows = []
+    for start in range(0, len(values), chunk_size):
+        rows.extend(query.filter(column.in_(values[start:start + chunk_size])).all())
+    return rows
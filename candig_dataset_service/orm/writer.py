@@ -0,0 +1,137 @@
+"""
+Group-commit writer for concurrent inserts
+
+Under SQLite every commit takes the database write lock and syncs
+the journal to disk, so many small concurrent commits contend for the
+lock and are capped by the fsync rate. The writer funnels inserts from
+all request threads of a process through one thread, which commits
+everything that arrives within a short window as a single transaction.
+"""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+# queued by stop(): commit what came before it, then exit
+_STOP = object()
+
+
+class GroupCommitWriter():
+    """
+    Batches inserts submitted from request threads into shared transactions.
+
+    Example::
+
+    >>> writer = GroupCommitWriter(sessionmaker(bind=engine), window=0.005)
+    >>> writer.submit(Dataset(**body)).result()  # blocks until committed
+    """
+
+    def __init__(self, session_factory, window=0.005, max_batch=100):
+        """
+        :param session_factory: callable returning a new Session
+        :param window: seconds to wait for more writes after the first of a batch
+        :param max_batch: maximum number of submissions committed together
+        """
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, *objects):
+        """
+        Queue ORM objects to be inserted in the same transaction
+
+        :return: Future resolved once the batch holding the objects commits,
+            or carrying the exception that made the insert fail
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((objects, future))
+        return future
+
+    def _ensure_started(self):
+        """
+        Start the writer thread, once per process: threads do not survive
+        a fork, so preforked workers each start their own on first use.
+        """
+        pid = os.getpid()
+        if self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread.is_alive():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='group-commit-writer',
+                                            daemon=True)
+            self._pid = pid
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Commit the submissions queued so far and stop the writer thread
+
+        :param timeout: seconds to wait for the thread, or None to wait
+            until it exits
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None or self._pid != os.getpid() or not thread.is_alive():
+                return
+            self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _run(self):
+        """
+        Writer loop: collect a batch, commit it, resolve its futures
+        """
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        """
+        Commit a batch in one transaction. If it fails, each submission
+        is retried on its own so that one bad row (e.g. a duplicate id)
+        only fails its own request.
+        """
+        session = self.session_factory(expire_on_commit=False)
+        try:
+            for objects, _ in batch:
+                session.add_all(objects)
+            session.commit()
+        except Exception as e:  # pylint: disable=broad-except
+            # every future must be resolved, or its request would hang
+            session.rollback()
+            if len(batch) > 1:
+                for item in batch:
+                    self._commit([item])
+            else:
+                batch[0][1].set_exception(e)
+            return
+        finally:
+            session.close()
+
+        for _, future in batch:
+            future.set_result(None)
@@ -0,0 +1,21 @@
+"""
+Helpers shared by the test suites
+"""
+
+import contextlib
+
+from candig_dataset_service.orm.instrumentation import collect_queries
+
+
+@contextlib.contextmanager
+def max_queries(limit):
+    """
+    Fail if the block runs more than limit database queries, e.g. when
+    an endpoint starts querying once per row (N+1)
+
+    :return: the QueryStats of the block
+    """
+    with collect_queries(record=True) as stats:
+        yield stats
+    assert stats.count <= limit, '{} queries, expected at most {}:\n{}'.format(
+        stats.count, limit, '\n'.join(stats.statements))
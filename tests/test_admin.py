@@ -0,0 +1,102 @@
+"""
+Test suite for the admin command line tools
+"""
+
+import os
+import sys
+import gzip
+import json
+import pytest
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service import admin
+from candig_dataset_service.api import operations
+from tests.test_operations import load_test_client, TEST_DB_URI  # pylint: disable=unused-import
+
+
+def test_delete_dry_run(test_client, capsys):
+    """
+    admin delete --dry-run
+    """
+    _, _, context, _, _ = test_client
+
+    assert admin.main(['--uri', TEST_DB_URI, 'delete', '--tags', 'candig', '--dry-run']) == 0
+    assert capsys.readouterr().out.strip() == '2 datasets match'
+
+    with context:
+        datasets, _, _ = operations.search_datasets()
+        assert len(datasets) == 2
+
+
+def test_delete(test_client, capsys):
+    """
+    admin delete
+    """
+    _, ds2, context, _, _ = test_client
+
+    assert admin.main(['--uri', TEST_DB_URI, 'delete', '--ontologies', 'DUO:0000018']) == 0
+    assert capsys.readouterr().out.strip() == '1 datasets deleted'
+
+    with context:
+        datasets, _, _ = operations.search_datasets()
+        assert datasets == [ds2]
+
+
+def test_delete_requires_filter(test_client):
+    """
+    admin delete without filters
+    """
+    assert admin.main(['--uri', TEST_DB_URI, 'delete']) == 1
+
+
+def test_export(test_client, tmp_path, capsys):
+    """
+    admin export
+    """
+    out = str(tmp_path / 'export.ndjson.gz')
+
+    assert admin.main(['--uri', TEST_DB_URI, 'export', '--out', out]) == 0
+    assert capsys.readouterr().out.strip() == \
+        'Exported 2 datasets and 2 change logs to {}'.format(out)
+
+    with gzip.open(out) as export:
+        records = [json.loads(line) for line in export]
+    with open(out + '.manifest.json') as manifest:
+        assert json.load(manifest) == records[-1]['data']
+
+
+def test_export_since(test_client, tmp_path, capsys):
+    """
+    admin export --since accepts the date-times /datasets/export accepts
+    """
+    out = str(tmp_path / 'export.ndjson.gz')
+
+    assert admin.main(['--uri', TEST_DB_URI, 'export', '--out', out,
+                       '--since', '2000-01-01T00:00:00Z']) == 0
+    assert capsys.readouterr().out.startswith('Exported 2 datasets')
+    assert admin.main(['--uri', TEST_DB_URI, 'export', '--out', out,
+                       '--since', '2999-01-01T00:00:00+02:00']) == 0
+    assert capsys.readouterr().out.startswith('Exported 0 datasets')
+    assert admin.main(['--uri', TEST_DB_URI, 'export', '--out', out, '--since', 'yesterday']) == 1
+
+
+@pytest.mark.skipif(not TEST_DB_URI.startswith('sqlite'), reason='GUID storage is SQLite only')
+def test_migrate_guid(test_client, capsys):
+    """
+    admin migrate-guid
+    """
+    ds1, _, context, _, _ = test_client
+
+    # the two datasets and their two 'created' events
+    assert admin.main(['--uri', TEST_DB_URI, 'migrate-guid', '--to', 'hex']) == 0
+    assert capsys.readouterr().out.strip() == 'Converted 4 ids to hex storage'
+
+    with context:
+        result, code, _ = operations.get_dataset_by_id(ds1['id'])
+        assert code == 200
+        assert result['name'] == ds1['name']
+
+    assert admin.main(['--uri', TEST_DB_URI, 'migrate-guid']) == 0
+    assert capsys.readouterr().out.strip() == 'Converted 4 ids to binary storage'
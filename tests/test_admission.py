@@ -0,0 +1,167 @@
+"""
+Test suite for admission control
+"""
+
+import os
+import sys
+import time
+import threading
+import pytest
+
+from prometheus_client import REGISTRY
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.api import admission
+from candig_dataset_service.api.admission import ConcurrencyLimit, TokenBuckets
+from tests.test_operations import load_test_client  # pylint: disable=unused-import
+
+SEARCH = 'candig_dataset_service.api.operations.search_datasets'
+CHANGES = 'candig_dataset_service.api.operations.get_dataset_changes'
+
+
+def rejections(operation, reason):
+    return REGISTRY.get_sample_value('dataset_service_admission_rejections_total',
+                                     {'operation': operation, 'reason': reason}) or 0
+
+
+def get(url, key='reader'):
+    return app.app.test_client().get(url, headers={'Authorization': key})
+
+
+def test_concurrency_limit():
+    """
+    Requests beyond the limit wait in the queue; beyond the queue they are refused
+    """
+    limit = ConcurrencyLimit('test', limit=1, queue=1, timeout=5)
+    assert limit.acquire()
+
+    waited = []
+    waiter = threading.Thread(target=lambda: waited.append(limit.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    assert not limit.acquire()
+
+    limit.release()
+    waiter.join()
+    assert waited == [True]
+    limit.release()
+    assert limit.acquire()
+
+
+def test_concurrency_limit_timeout():
+    """
+    A request not given a slot in time is refused
+    """
+    limit = ConcurrencyLimit('test', limit=1, queue=1, timeout=0.1)
+    assert limit.acquire()
+    start = time.monotonic()
+    assert not limit.acquire()
+    assert time.monotonic() - start >= 0.1
+
+
+def test_token_buckets():
+    """
+    Each key may make a burst of requests, then rate requests per second
+    """
+    buckets = TokenBuckets()
+    assert buckets.take('a', 10, 2) == 0
+    assert buckets.take('a', 10, 2) == 0
+    assert 0 < buckets.take('a', 10, 2) <= 0.1
+    assert buckets.take('b', 10, 2) == 0
+    time.sleep(0.1)
+    assert buckets.take('a', 10, 2) == 0
+
+
+def test_rate_limit(test_client, monkeypatch):
+    """
+    Requests over an API key's rate limit are answered 429
+    """
+    monkeypatch.setattr(admission, 'BUCKETS', TokenBuckets())
+    monkeypatch.setitem(app.app.config, 'RATE_LIMIT', 0.5)
+    monkeypatch.setitem(app.app.config, 'RATE_LIMIT_BURST', 1)
+    before = rejections(SEARCH, 'rate_limited')
+
+    assert get('/v2/datasets/search').status_code == 200
+    response = get('/v2/datasets/search')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert response.json['code'] == 429
+    assert get('/v2/datasets/search', key='other').status_code == 200
+    assert rejections(SEARCH, 'rate_limited') == before + 1
+
+
+def test_concurrency_limit_full(test_client, monkeypatch):
+    """
+    Requests finding an operation's queue full are answered 503
+    """
+    limit = admission.LIMITS[SEARCH]
+    monkeypatch.setattr(limit, 'queue', 0)
+    before = rejections(SEARCH, 'overloaded')
+
+    for _ in range(limit.limit):
+        assert limit.acquire()
+    try:
+        response = get('/v2/datasets/search')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(limit.timeout)
+        assert get('/v2/datasets/getVersions').status_code == 200
+
+        monkeypatch.setitem(app.app.config, 'CONCURRENCY_LIMITS', False)
+        assert get('/v2/datasets/search').status_code == 200
+    finally:
+        for _ in range(limit.limit):
+            limit.release()
+
+    monkeypatch.setitem(app.app.config, 'CONCURRENCY_LIMITS', True)
+    assert get('/v2/datasets/search').status_code == 200
+    assert rejections(SEARCH, 'overloaded') == before + 1
+
+
+def test_long_poll_limit(test_client):
+    """
+    Long-polls on the change feed take slots of their own: while they
+    wait, the feed is still read, and long-polls beyond their limit are
+    answered 503
+    """
+    long_polls = admission.LIMITS[CHANGES + admission.LONG_POLL]
+    cursor = get('/v2/datasets/changes?since=0').json['cursor']
+    url = '/v2/datasets/changes?since={}&timeout=2'.format(cursor)
+
+    statuses = []
+    waiters = [threading.Thread(target=lambda: statuses.append(get(url).status_code))
+               for _ in range(long_polls.limit)]
+    for waiter in waiters:
+        waiter.start()
+    deadline = time.monotonic() + 2
+    while long_polls._running < long_polls.limit and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert long_polls._running == long_polls.limit
+
+    try:
+        for _ in range(admission.LIMITS[CHANGES].limit + 1):
+            assert get('/v2/datasets/changes?since=0').status_code == 200
+        assert get(url).status_code == 503
+    finally:
+        for waiter in waiters:
+            waiter.join()
+    assert statuses == [200] * long_polls.limit
+
+@pytest.mark.parametrize('queued', [0, 1])
+def test_queue_depth(queued):
+    """
+    Waiting requests are counted in the queue depth gauge
+    """
+    limit = ConcurrencyLimit('queue-test', limit=1, queue=1, timeout=5)
+    assert limit.acquire()
+    waiters = [threading.Thread(target=limit.acquire) for _ in range(queued)]
+    for waiter in waiters:
+        waiter.start()
+    time.sleep(0.1)
+    assert REGISTRY.get_sample_value('dataset_service_admission_queue_depth',
+                                     {'operation': 'queue-test'}) == queued
+    limit.release()
+    for waiter in waiters:
+        waiter.join()
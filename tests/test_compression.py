@@ -0,0 +1,121 @@
+"""
+Test suite for response compression
+"""
+
+import os
+import sys
+import gzip
+import json
+import pytest
+
+import flask
+from werkzeug.datastructures import Accept
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.api import compression
+from candig_dataset_service.api.compression import choose_encoding, compress_response
+from tests.test_operations import load_test_client  # pylint: disable=unused-import
+
+HEADERS = {'Authorization': 'reader'}
+
+
+@pytest.fixture(name='compress_config')
+def load_compress_config():
+    """
+    Compress every response with gzip, restoring the settings afterwards
+    """
+    saved = app.app.config.copy()
+    app.app.config['COMPRESS_ENCODINGS'] = ['gzip']
+    app.app.config['COMPRESS_MIN_SIZE'] = 0
+    yield app.app.config
+    app.app.config.clear()
+    app.app.config.update(saved)
+
+
+def test_choose_encoding():
+    """
+    The client's quality values win over the server's preference
+    """
+    accept = Accept([('gzip', 1), ('br', 0.5)])
+    assert choose_encoding(accept, ['br', 'gzip']) == 'gzip'
+    assert choose_encoding(Accept([('*', 1)]), ['gzip']) == 'gzip'
+    assert choose_encoding(Accept([('deflate', 1)]), ['gzip']) is None
+    assert choose_encoding(accept, []) is None
+
+
+def test_search_gzip(test_client, compress_config):
+    """
+    Searches are gzipped for clients accepting it, with a weak ETag
+    """
+    client = app.app.test_client()
+    plain = client.get('/v2/datasets/search', headers=HEADERS)
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+    response = client.get('/v2/datasets/search', headers=dict(HEADERS, **{'Accept-Encoding': 'gzip'}))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert response.headers['ETag'] == 'W/' + plain.headers['ETag']
+
+    response = client.get('/v2/datasets/search', headers=dict(HEADERS, **{
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}))
+    assert response.status_code == 304
+    assert response.headers['ETag'].startswith('W/')
+
+
+def test_small_response_not_compressed(test_client, compress_config):
+    """
+    Responses under COMPRESS_MIN_SIZE are sent as they are
+    """
+    compress_config['COMPRESS_MIN_SIZE'] = 1 << 20
+    response = app.app.test_client().get('/v2/datasets/search',
+                                         headers=dict(HEADERS, **{'Accept-Encoding': 'gzip'}))
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.json) == 2
+
+
+def test_patch_weak_if_match(test_client, compress_config):
+    """
+    The weak tag of a compressed dataset can be sent back in If-Match
+    """
+    ds1, _, _, _, _ = test_client
+    client = app.app.test_client()
+    headers = dict(HEADERS, **{'Accept-Encoding': 'gzip'})
+    etag = client.get('/v2/datasets/' + ds1['id'], headers=headers).headers['ETag']
+    assert etag.startswith('W/')
+
+    response = client.patch('/v2/datasets/' + ds1['id'], json={'description': 'changed'},
+                            headers=dict(headers, **{'If-Match': etag}))
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'br', 'zstd'])
+def test_streamed_ndjson(encoding):
+    """
+    Streamed responses are compressed chunk by chunk
+    """
+    if encoding not in compression.COMPRESSORS:
+        pytest.skip(encoding + ' is not installed')
+    lines = [json.dumps({'seq': i, 'name': 'dataset_{}'.format(i)}) + '\n' for i in range(1000)]
+
+    stream_app = flask.Flask(__name__)
+    stream_app.after_request(compress_response)
+
+    @stream_app.route('/stream')
+    def stream():  # pylint:disable=unused-variable
+        return flask.Response((line.encode('utf-8') for line in lines), mimetype='application/x-ndjson')
+
+    response = stream_app.test_client().get('/stream', headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Content-Length' not in response.headers
+    if encoding == 'gzip':
+        data = gzip.decompress(response.data)
+    elif encoding == 'br':
+        data = compression.brotli.decompress(response.data)
+    else:
+        data = compression.zstandard.ZstdDecompressor().decompressobj().decompress(response.data)
+    assert data.decode('utf-8') == ''.join(lines)
@@ -0,0 +1,200 @@
+"""
+Test suite for database query instrumentation
+"""
+
+import os
+import sys
+import json
+import uuid
+import logging
+import pytest
+
+from prometheus_client import REGISTRY
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service import orm
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.orm.models import Dataset
+from candig_dataset_service.orm.instrumentation import collect_queries, normalize_statement, \
+    SlowQueryLog, SLOW_QUERIES
+from tests.helpers import max_queries
+from tests.test_logging import ListHandler
+from tests.test_operations import load_test_client  # pylint: disable=unused-import
+
+HEADERS = {'Authorization': 'reader'}
+OPERATIONS = 'candig_dataset_service.api.operations.'
+
+# queries allowed per request, whatever the number of datasets
+ENDPOINTS = [
+    ('get', '/v2/datasets/{ds1}', None, 1),
+    ('get', '/v2/datasets/search', None, 2),
+    ('get', '/v2/datasets/search?tags=test', None, 2),
+    ('get', '/v2/datasets?ids={ds1},{ds2}', None, 1),
+    ('post', '/v2/datasets/lookup', {'ids': ['{ds1}', '{ds2}']}, 1),
+    ('get', '/v2/datasets/search/ontologies', None, 1),
+    ('get', '/v2/datasets/changes', None, 1),
+    ('get', '/v2/datasets/getVersions', None, 2),
+    ('get', '/v2/datasets/changelog/{version}', None, 1),
+    ('post', '/v2/datasets', {'name': 'new'}, 3),
+    ('patch', '/v2/datasets/{ds1}', {'description': 'patched'}, 5),
+    ('delete', '/v2/datasets/{ds2}', None, 5),
+    ('post', '/v2/datasets/changelog', {'version': '9.0', 'log': ['a']}, 1),
+]
+
+
+def request(method, url, body=None):
+    client = app.app.test_client()
+    if method == 'patch':
+        return client.patch(url, data=json.dumps(body), content_type='application/merge-patch+json',
+                            headers=HEADERS)
+    return getattr(client, method)(url, json=body, headers=HEADERS)
+
+
+@pytest.mark.parametrize('method, url, body, limit', ENDPOINTS)
+def test_max_queries(test_client, method, url, body, limit):
+    """
+    Endpoints run a bounded number of queries, with more datasets stored
+    """
+    ds1, ds2, context, cl1, _ = test_client
+    with context:
+        db_session = orm.get_session()
+        db_session.add_all([Dataset(id=uuid.uuid4().hex, name='extra_{}'.format(i), tags=['test'])
+                            for i in range(20)])
+        db_session.commit()
+
+    ids = dict(ds1=ds1['id'], ds2=ds2['id'], version=cl1['version'])
+    if body is not None:
+        body = json.dumps(body)
+        for key, value in ids.items():
+            body = body.replace('{%s}' % key, value)
+        body = json.loads(body)
+    with max_queries(limit):
+        response = request(method, url.format(**ids), body)
+    assert response.status_code < 300
+
+
+def test_collect_queries(test_client):
+    """
+    Queries, time and fetched rows are counted by every open block
+    """
+    _, _, context, _, _ = test_client
+    with context:
+        db_session = orm.get_session()
+        with collect_queries() as outer:
+            db_session.query(Dataset).all()
+            with collect_queries(record=True) as inner:
+                db_session.query(Dataset.id).first()
+    assert (outer.count, outer.rows) == (2, 3)
+    assert (inner.count, inner.rows) == (1, 1)
+    assert outer.seconds >= inner.seconds > 0
+    assert outer.statements is None
+    assert inner.statements[0].startswith('SELECT datasets.id')
+
+
+def test_max_queries_fails():
+    """
+    max_queries fails with the statements run
+    """
+    with pytest.raises(AssertionError, match='2 queries, expected at most 1'):
+        with max_queries(1):
+            orm.get_engine().execute('SELECT 1').fetchall()
+            orm.get_engine().execute('SELECT 2').fetchall()
+
+
+def test_server_timing(test_client):
+    """
+    Responses report the database time, queries and rows of the request
+    """
+    operation = OPERATIONS + 'search_datasets'
+
+    def observed(name):
+        return REGISTRY.get_sample_value(name, {'operation': operation}) or 0
+
+    # the catalog generation and the two datasets
+    queries, rows = observed('dataset_service_db_queries_sum'), observed('dataset_service_db_rows_sum')
+    response = request('get', '/v2/datasets/search')
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert response.headers['Server-Timing'].endswith(';desc="2 queries, 3 rows"')
+    assert observed('dataset_service_db_queries_sum') == queries + 2
+    assert observed('dataset_service_db_rows_sum') == rows + 3
+    assert observed('dataset_service_db_seconds_count') > 0
+
+
+@pytest.fixture(name='slow_queries')
+def load_slow_queries(monkeypatch):
+    """
+    Every statement is slow while the test runs; yields the slow_query
+    log entries
+    """
+    handler = ListHandler()
+    level = app.app.logger.level
+    app.app.logger.setLevel(logging.INFO)
+    app.app.logger.addHandler(handler)
+    monkeypatch.setattr(SLOW_QUERIES, 'threshold', 1e-9)
+    SLOW_QUERIES.clear()
+    yield lambda: [json.loads(message) for message in handler.messages if '"slow_query"' in message]
+    SLOW_QUERIES.clear()
+    app.app.logger.removeHandler(handler)
+    app.app.logger.setLevel(level)
+
+
+def test_normalize_statement():
+    """
+    Values, placeholders and IN lists do not change the fingerprint
+    """
+    assert normalize_statement("SELECT *\n  FROM datasets WHERE id IN (?, ?, ?) AND name = 'a''b'") == \
+        normalize_statement("SELECT * FROM datasets WHERE id IN (?) AND name = 'c'") == \
+        'SELECT * FROM datasets WHERE id IN (...) AND name = ?'
+    assert normalize_statement('SELECT * FROM datasets WHERE tags ?| ARRAY[%(tags_1)s, %(tags_2)s]') == \
+        'SELECT * FROM datasets WHERE tags ?| ARRAY[...]'
+    assert normalize_statement('SELECT datasets_1.id FROM datasets AS datasets_1 '
+                               'WHERE version = %(version_1)s LIMIT 10') == \
+        'SELECT datasets_1.id FROM datasets AS datasets_1 WHERE version = ? LIMIT ?'
+
+
+def test_slow_queries(test_client, slow_queries, monkeypatch):
+    """
+    Slow statements are logged with their plan, and listed by fingerprint
+    """
+    monkeypatch.setitem(app.app.config, 'ADMIN_KEYS', [HEADERS['Authorization']])
+    for tags in ('test', 'other'):
+        response = request('get', '/v2/datasets/search?tags=' + tags)
+        assert response.status_code == 200
+
+    entries = slow_queries()
+    assert len(entries) == 4
+    assert all(entry['operation'] == OPERATIONS + 'search_datasets' for entry in entries)
+    search = [entry for entry in entries if 'FROM datasets' in entry['statement']]
+    assert len(search) == 2
+    assert search[0]['fingerprint'] == search[1]['fingerprint']
+    assert search[0]['plan'] and search[0]['parameters'] != search[1]['parameters']
+
+    response = request('get', '/v2/datasets/admin/slow-queries?limit=1')
+    assert response.status_code == 200
+    assert response.json['threshold_ms'] == pytest.approx(1e-6)
+    query, = response.json['queries']
+    assert query['fingerprint'] in (entry['fingerprint'] for entry in entries)
+    assert query['count'] == 2
+    assert query['total_ms'] >= query['max_ms'] >= query['mean_ms'] > 0
+    assert query['plan']
+
+
+def test_slow_queries_admin_only(test_client, monkeypatch):
+    """
+    Slow statements are only listed to admin keys
+    """
+    monkeypatch.setitem(app.app.config, 'ADMIN_KEYS', ['admin'])
+    assert request('get', '/v2/datasets/admin/slow-queries').status_code == 403
+
+
+def test_slow_query_log_bounded():
+    """
+    The fingerprint with the least total time makes room for a new one
+    """
+    log = SlowQueryLog(threshold=0.1, max_fingerprints=2)
+    for statement, seconds in [('PRAGMA a', 3), ('PRAGMA b', 1), ('PRAGMA b', 1), ('PRAGMA c', 0.5)]:
+        log.observe(None, statement, (), seconds)
+    assert [(query.statement, query.count, query.seconds, query.plan) for query in log.top()] == \
+        [('PRAGMA a', 1, 3, None), ('PRAGMA c', 1, 0.5, None)]
@@ -0,0 +1,126 @@
+"""
+Test suite for API call logging
+"""
+
+import os
+import sys
+import json
+import argparse
+import logging
+import threading
+from datetime import datetime
+import pytest
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service.__main__ import app, _sample_rate
+from candig_dataset_service.api.logging import BackgroundHandler
+from candig_dataset_service.api.serialization import dumps
+from tests.test_operations import load_test_client  # pylint: disable=unused-import
+
+
+class ListHandler(logging.Handler):
+    """Handler keeping the messages it is given, and the threads it is called on"""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+        self.threads.add(threading.current_thread().name)
+
+
+@pytest.fixture(name='log_entries')
+def load_log_entries():
+    """
+    apilog entries written while the test runs
+    """
+    handler = ListHandler()
+    level = app.app.logger.level
+    app.app.logger.setLevel(logging.INFO)
+    app.app.logger.addHandler(handler)
+    yield lambda: [json.loads(message) for message in handler.messages if '"method"' in message]
+    app.app.logger.removeHandler(handler)
+    app.app.logger.setLevel(level)
+
+
+def post(body, **headers):
+    headers['Authorization'] = 'secret'
+    return app.app.test_client().post('/v2/datasets', json=body, headers=headers)
+
+
+def test_apilog_headers_and_body(test_client, log_entries, monkeypatch):
+    """
+    Only allowlisted headers are logged, and the body is truncated
+    """
+    monkeypatch.setitem(app.app.config, 'LOG_BODY_BYTES', 20)
+    monkeypatch.setitem(app.app.config, 'LOG_HEADERS', ['User-Agent'])
+    body = {'name': 'logged', 'tags': ['x' * 50] * 20}
+    assert post(body, **{'User-Agent': 'tests'}).status_code == 201
+
+    entry, = log_entries()
+    assert entry['method'] == 'POST'
+    assert datetime.fromisoformat(entry['timestamp'])
+    assert entry['headers'] == {'User-Agent': 'tests'}
+    sent = dumps(body)
+    assert entry['data'] == sent[:20] + '...[{} bytes]'.format(len(sent))
+
+    monkeypatch.setitem(app.app.config, 'LOG_BODY_BYTES', 0)
+    assert post({'name': 'unlogged body'}).status_code == 201
+    assert 'data' not in log_entries()[-1]
+
+
+def test_apilog_sampling(test_client, log_entries, monkeypatch):
+    """
+    Successful calls are logged at the rate set for their handler, with
+    the body truncated
+    """
+    monkeypatch.setitem(app.app.config, 'LOG_SAMPLE_RATE', 0)
+    monkeypatch.setitem(app.app.config, 'LOG_SAMPLE_RATES', {'post_dataset': 100})
+    monkeypatch.setitem(app.app.config, 'LOG_BODY_BYTES', 10)
+    client = app.app.test_client()
+    search = client.get('/v2/datasets/search', headers={'Authorization': 'key'})
+    assert search.status_code == 200
+    assert search.get_json()
+    body = {'name': 'sampled'}
+    assert post(body).status_code == 201
+
+    entry, = log_entries()
+    assert entry['path'] == '/v2/datasets?'
+    sent = dumps(body)
+    assert entry['data'] == sent[:10] + '...[{} bytes]'.format(len(sent))
+
+    monkeypatch.setitem(app.app.config, 'LOG_SAMPLE_RATES', {'search_datasets': 100})
+    assert client.get('/v2/datasets/search', headers={'Authorization': 'key'}).status_code == 200
+    assert post({'name': 'unsampled'}).status_code == 201
+    assert [entry['path'] for entry in log_entries()] == ['/v2/datasets?', '/v2/datasets/search?']
+
+
+def test_background_handler():
+    """
+    Records are written on the listener thread, and all of them by close()
+    """
+    written = ListHandler()
+    handler = BackgroundHandler(written)
+    log = logging.getLogger('test_background_handler')
+    log.addHandler(handler)
+    try:
+        for i in range(100):
+            log.warning('record %d', i)
+    finally:
+        log.removeHandler(handler)
+        handler.close()
+    assert written.messages == ['record {}'.format(i) for i in range(100)]
+    assert threading.current_thread().name not in written.threads
+
+
+def test_sample_rate_option():
+    """
+    --log-sample-rates takes HANDLER=RATE pairs
+    """
+    assert _sample_rate('search_datasets=10') == ('search_datasets', 10)
+    with pytest.raises(argparse.ArgumentTypeError):
+        _sample_rate('search_datasets')
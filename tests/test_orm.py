@@ -0,0 +1,259 @@
+"""
+Test suite to unit test ORM engine and schema handling
+"""
+
+import os
+import sys
+import uuid
+import warnings
+import datetime
+import multiprocessing
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service import orm
+from candig_dataset_service.orm.models import ChangeLog, Dataset
+
+
+@pytest.fixture(name='db_uri')
+def load_db_uri(tmp_path):
+    orm.close_session()
+    return 'sqlite:///' + str(tmp_path / 'orm.db')
+
+
+def test_sqlite_pragmas(db_uri):
+    """
+    init_db pragmas
+    """
+    orm.init_db(db_uri, pragmas={'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                                 'busy_timeout': 1234})
+
+    with orm.get_engine().connect() as conn:
+        assert conn.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert conn.execute('PRAGMA synchronous').scalar() == 1
+        assert conn.execute('PRAGMA busy_timeout').scalar() == 1234
+
+
+def test_sqlite_pool(db_uri):
+    """
+    init_db pool_size
+    """
+    orm.init_db(db_uri, pool_size=2, pool_pre_ping=True)
+
+    assert isinstance(orm.get_engine().pool, QueuePool)
+    assert orm.get_engine().pool.size() == 2
+
+
+def test_read_only(db_uri):
+    """
+    init_db read_only
+    """
+    orm.init_db(db_uri)
+    orm.init_db(db_uri, read_only=True)
+    db_session = orm.get_session()
+
+    assert db_session.query(ChangeLog).count() == 0
+    db_session.add(ChangeLog(version='1.0', log=[]))
+    with pytest.raises(orm.ORMException):
+        db_session.commit()
+    db_session.rollback()
+
+
+def test_add_missing_columns(db_uri):
+    """
+    init_db on a datasets table from an older release
+    """
+    engine = create_engine(db_uri)
+    engine.execute('CREATE TABLE datasets (id CHAR(32) PRIMARY KEY, version VARCHAR(10), '
+                   'tags VARCHAR, name VARCHAR(100) NOT NULL, description VARCHAR(100), '
+                   'ontologies VARCHAR, ontologies_internal VARCHAR, created DATETIME)')
+    engine.execute("INSERT INTO datasets (id, name) VALUES ('{}', 'old')".format('0' * 32))
+    engine.dispose()
+
+    orm.init_db(db_uri)
+
+    with orm.get_engine().connect() as conn:
+        assert conn.execute('SELECT revision, updated FROM datasets').fetchall() == [(1, None)]
+
+
+def test_guid_binary_storage(db_uri):
+    """
+    New databases store GUIDs as 16 bytes, read back as hex
+    """
+    orm.init_db(db_uri)
+    db_session = orm.get_session()
+    iid = 'a5f9f8e3-3c48-4e5d-9a0f-2f7a1f0d1c33'
+    db_session.add(Dataset(id=iid, name='binary'))
+    db_session.commit()
+    db_session.expunge_all()
+
+    with orm.get_engine().connect() as conn:
+        assert conn.execute('SELECT typeof(id), length(id) FROM datasets').fetchall() == [('blob', 16)]
+    assert db_session.query(Dataset).get(iid.replace('-', '')).id == iid.replace('-', '')
+
+
+def test_guid_migration(db_uri):
+    """
+    Existing hex databases keep working, and migrate to binary storage
+    """
+    orm.init_db(db_uri, guid_storage='hex')
+    db_session = orm.get_session()
+    ids = [('%032x' % i) for i in range(1, 4)]
+    db_session.add_all([Dataset(id=iid, name='hex_{}'.format(iid)) for iid in ids])
+    db_session.commit()
+    orm.close_session()
+
+    orm.init_db(db_uri)
+    assert orm.get_engine().dialect.guid_storage == 'hex'
+    assert orm.get_session().query(Dataset).get(ids[0]).name == 'hex_' + ids[0]
+    orm.close_session()
+
+    assert orm.migrate_guid_storage(orm.get_engine(), 'binary') == 3
+    assert orm.migrate_guid_storage(orm.get_engine(), 'binary') == 0
+
+    orm.init_db(db_uri)
+    db_session = orm.get_session()
+    assert orm.get_engine().dialect.guid_storage == 'binary'
+    assert sorted(d.id for d in db_session.query(Dataset)) == ids
+    assert db_session.query(Dataset).get(ids[1]).name == 'hex_' + ids[1]
+    with orm.get_engine().connect() as conn:
+        assert conn.execute("SELECT count(*) FROM datasets WHERE typeof(id) = 'blob'").scalar() == 3
+
+
+def test_json_codec_mixed_rows(db_uri):
+    """
+    Rows written with different codecs all decode, and searches still match
+    """
+    pytest.importorskip('msgpack')
+    from candig_dataset_service.orm.queries import dataset_filters
+
+    orm.init_db(db_uri, json_codec='json')
+    db_session = orm.get_session()
+    db_session.add(Dataset(id='%032x' % 1, name='json', tags=['a'], ontologies=[{'id': 'DUO:1'}]))
+    db_session.add(ChangeLog(version='1.0', log=['first']))
+    db_session.commit()
+    orm.close_session()
+
+    orm.init_db(db_uri, json_codec='msgpack')
+    db_session = orm.get_session()
+    db_session.add(Dataset(id='%032x' % 2, name='msgpack', tags=['b', 'é'],
+                           ontologies=[{'id': 'DUO:2'}], ontologies_internal={'duo': []}))
+    db_session.add(ChangeLog(version='2.0', log=['second']))
+    db_session.commit()
+    db_session.expunge_all()
+
+    with orm.get_engine().connect() as conn:
+        rows = conn.execute('SELECT typeof(tags), typeof(ontologies) FROM datasets ORDER BY name')
+        assert rows.fetchall() == [('text', 'text'), ('text', 'blob')]
+
+    datasets = db_session.query(Dataset).order_by(Dataset.name).all()
+    assert [d.ontologies for d in datasets] == [[{'id': 'DUO:1'}], [{'id': 'DUO:2'}]]
+    assert [c.log for c in db_session.query(ChangeLog).order_by(ChangeLog.version)] == \
+        [['first'], ['second']]
+    search = db_session.query(Dataset).filter(*dataset_filters(tags=['é', 'a']))
+    assert sorted(d.name for d in search) == ['json', 'msgpack']
+
+
+def test_ontologies_internal_deferred(db_uri):
+    """
+    ontologies_internal is only loaded when accessed
+    """
+    orm.init_db(db_uri)
+    db_session = orm.get_session()
+    db_session.add(Dataset(id='%032x' % 1, name='deferred', ontologies_internal={'duo': []}))
+    db_session.commit()
+    db_session.expunge_all()
+
+    dataset = db_session.query(Dataset).one()
+    assert 'ontologies_internal' not in vars(dataset)
+    assert dataset.ontologies_internal == {'duo': []}
+
+
+def test_dataset_serializer(db_uri):
+    """
+    The compiled serializer matches dump(), with JSON-ready values
+    """
+    from candig_dataset_service.orm.serializers import dataset_serializer
+
+    orm.init_db(db_uri)
+    db_session = orm.get_session()
+    created = datetime.datetime(2020, 6, 1, 12, 30)
+    db_session.add(Dataset(id='%032x' % 1, name='serialized', tags=['a'], description='',
+                           created=created, ontologies_internal={'duo': []}))
+    db_session.commit()
+    db_session.expunge_all()
+
+    dataset = db_session.query(Dataset).one()
+    expected = orm.dump(dataset)
+    expected['created'] = '2020-06-01T12:30:00Z'
+
+    assert dataset_serializer.from_object(dataset) == expected
+    assert [dataset_serializer(row) for row in db_session.query(*dataset_serializer.columns)] == \
+        [expected]
+    assert dataset_serializer.from_mapping({'id': uuid.UUID(int=1), 'created': created}) == \
+        {'id': uuid.UUID(int=1).hex, 'created': '2020-06-01T12:30:00Z'}
+
+
+def test_read_replica_session(db_uri, tmp_path):
+    """
+    get_read_session is bound to a read-only replica
+    """
+    replica_uri = 'sqlite:///' + str(tmp_path / 'replica.db')
+    orm.init_db(replica_uri)
+    orm.init_db(db_uri, replica_uris=[replica_uri])
+
+    assert orm.get_read_session().bind is orm.get_replicas()[0]
+    assert orm.get_read_session(primary=True) is orm.get_session()
+
+    db_session = orm.get_read_session()
+    db_session.add(ChangeLog(version='1.0', log=[]))
+    with pytest.raises(orm.ORMException):
+        db_session.commit()
+    db_session.rollback()
+    orm.remove_read_session()
+
+
+def test_prewarm_pools(db_uri):
+    """
+    dispose_engines empties the pool, prewarm_pools refills it
+    """
+    orm.init_db(db_uri, pool_size=3)
+    pool = orm.get_engine().pool
+
+    orm.dispose_engines()
+    assert orm.get_engine().pool.checkedin() == 0
+    orm.prewarm_pools()
+    assert orm.get_engine().pool.checkedin() == 3
+    assert orm.get_engine().pool is not pool
+
+
+def _query_in_child(queue):
+    """Prewarm after fork and query, failing on an inherited connection"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        orm.prewarm_pools()
+        queue.put(orm.get_session().query(ChangeLog).count())
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_fork_after_dispose(db_uri):
+    """
+    Workers forked after dispose_engines do not inherit connections
+    """
+    orm.init_db(db_uri, pool_size=2)
+    orm.get_session().query(ChangeLog).count()
+    orm.dispose_engines()
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    child = context.Process(target=_query_in_child, args=(queue,))
+    child.start()
+    child.join()
+
+    assert child.exitcode == 0
+    assert queue.get(timeout=1) == 0
@@ -0,0 +1,140 @@
+"""
+Test suite for request profiling
+"""
+
+import os
+import sys
+import pstats
+import cProfile
+import pytest
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.api import profiling
+from candig_dataset_service.api.admission import TokenBuckets
+from candig_dataset_service.api.profiling import collapsed_stacks
+from tests.test_operations import load_test_client  # pylint: disable=unused-import
+
+
+@pytest.fixture(name='profiles')
+def load_profiles(tmp_path, monkeypatch):
+    """
+    Profiling on, writing to a temporary directory
+    """
+    monkeypatch.setitem(app.app.config, 'PROFILE_LIMIT', 60)
+    monkeypatch.setitem(app.app.config, 'ADMIN_KEYS', ['admin'])
+    monkeypatch.setitem(app.app.config, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, '_BUCKET', TokenBuckets())
+    return tmp_path
+
+
+def search(key='admin', **headers):
+    headers['Authorization'] = key
+    return app.app.test_client().get('/v2/datasets/search', headers=headers)
+
+
+def get_profile(profile_id, profile_format='collapsed', key='admin'):
+    return app.app.test_client().get(
+        '/v2/datasets/admin/profiles/{}?format={}'.format(profile_id, profile_format),
+        headers={'Authorization': key})
+
+
+def test_profile(test_client, profiles):
+    """
+    A request sent with X-Profile has its profile written, in both formats
+    """
+    response = search(**{'X-Profile': 'true'})
+    assert response.status_code == 200
+    profile_id = response.headers['X-Profile-Id']
+    assert sorted(os.listdir(profiles)) == [profile_id + '.collapsed', profile_id + '.pstats']
+
+    collapsed = get_profile(profile_id)
+    assert collapsed.status_code == 200
+    assert collapsed.mimetype == 'text/plain'
+    lines = collapsed.get_data(as_text=True).splitlines()
+    assert any('(search_datasets);' in line for line in lines)
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+
+    data = get_profile(profile_id, 'pstats')
+    assert data.status_code == 200
+    path = profiles / 'downloaded.pstats'
+    path.write_bytes(data.get_data())
+    assert any(name == 'search_datasets' for _, _, name in pstats.Stats(str(path)).stats)
+
+
+def test_profile_refused(test_client, profiles, monkeypatch):
+    """
+    Requests are only profiled for admin keys, within the limit
+    """
+    assert 'X-Profile-Id' not in search().headers
+    monkeypatch.setitem(app.app.config, 'PROFILE_LIMIT', 1)
+    assert 'X-Profile-Id' not in search('reader', **{'X-Profile': 'true'}).headers
+    assert 'X-Profile-Id' in search(**{'X-Profile': 'true'}).headers
+
+    response = search(**{'X-Profile': 'true'})
+    assert response.status_code == 200
+    assert 'X-Profile-Id' not in response.headers
+    assert len(os.listdir(profiles)) == 2
+
+    monkeypatch.setattr(profiling, '_BUCKET', TokenBuckets())
+    monkeypatch.setitem(app.app.config, 'ADMIN_KEYS', [])
+    assert 'X-Profile-Id' not in search(**{'X-Profile': 'true'}).headers
+    assert len(os.listdir(profiles)) == 2
+
+    profile_id = os.listdir(profiles)[0].split('.')[0]
+    assert get_profile(profile_id, key='reader').status_code == 403
+
+
+def test_profile_not_found(test_client, profiles):
+    """
+    Unknown and malformed profile ids are refused
+    """
+    assert get_profile('0' * 32).status_code == 404
+    assert get_profile('../../operations').status_code == 404
+    assert get_profile('x' * 32).status_code == 400
+
+
+def test_profiles_pruned(test_client, profiles, monkeypatch):
+    """
+    Only the latest MAX_PROFILES profiles are kept
+    """
+    monkeypatch.setattr(profiling, 'MAX_PROFILES', 2)
+    ids = [search(**{'X-Profile': '1'}).headers['X-Profile-Id'] for _ in range(3)]
+    assert sorted(os.listdir(profiles)) == sorted(profile_id + '.' + profile_format
+                                                  for profile_id in ids[1:]
+                                                  for profile_format in ('collapsed', 'pstats'))
+
+
+def leaf(n):
+    return sum(i * i for i in range(n))
+
+
+def branch():
+    return leaf(20000) + leaf(60000)
+
+
+def root():
+    return branch() + leaf(20000)
+
+
+def test_collapsed_stacks():
+    """
+    The time of a function is split between the stacks calling it
+    """
+    profiler = cProfile.Profile()
+    profiler.runcall(root)
+    stacks = {}
+    for line in collapsed_stacks(pstats.Stats(profiler)).splitlines():
+        stack, microseconds = line.rsplit(' ', 1)
+        frames = tuple(frame.split('(')[-1].rstrip(')') for frame in stack.split(';'))
+        stacks[frames] = int(microseconds)
+
+    def total(prefix):
+        return sum(value for frames, value in stacks.items() if frames[:len(prefix)] == prefix)
+
+    assert total(('root', 'branch', 'leaf')) > 0
+    assert total(('root', 'leaf')) > 0
+    # leaf(80000) from branch, leaf(20000) from root
+    assert 2 < total(('root', 'branch', 'leaf')) / total(('root', 'leaf')) < 6
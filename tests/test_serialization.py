@@ -0,0 +1,80 @@
+"""
+Test suite for JSON serialization of responses and logs
+"""
+
+import os
+import sys
+import json
+import uuid
+import datetime
+import pytest
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.api import serialization
+from candig_dataset_service.api.logging import structured_log
+from tests.test_operations import load_test_client  # pylint: disable=unused-import
+
+VALUE = {
+    'id': uuid.UUID('be2ba51c-8dfe-4619-b832-31c4a087a589'),
+    'created': datetime.datetime(2020, 1, 2, 3, 4, 5, 6789),
+    'utc': datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+    'local': datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=-8))),
+    'day': datetime.date(2020, 1, 2),
+    'tags': ['é', 1, None, True],
+}
+EXPECTED = '{"id":"be2ba51c-8dfe-4619-b832-31c4a087a589","created":"2020-01-02T03:04:05.006789Z",' \
+           '"utc":"2020-01-02T03:04:05Z","local":"2020-01-02T03:04:05-08:00","day":"2020-01-02",' \
+           '"tags":["é",1,null,true]}'
+
+
+@pytest.fixture(name='library', params=['orjson', 'json'])
+def load_library(request, monkeypatch):
+    """
+    Run with orjson, when installed, and with the stdlib fallback
+    """
+    if request.param == 'orjson' and serialization.orjson is None:
+        pytest.skip('orjson is not installed')
+    if request.param == 'json':
+        monkeypatch.setattr(serialization, 'orjson', None)
+    return request.param
+
+
+def test_dumps(library):
+    """
+    Both libraries write the same compact JSON
+    """
+    assert serialization.dumps(VALUE) == EXPECTED
+    assert serialization.loads(EXPECTED)['tags'] == VALUE['tags']
+
+
+def test_dumps_default(library):
+    """
+    Other types need a default function
+    """
+    with pytest.raises(TypeError):
+        serialization.dumps({'value': object()})
+    assert serialization.dumps({'value': {1, 2} - {1}}, default=list) == '{"value":[2]}'
+
+
+def test_structured_log():
+    """
+    Log entries serialize any value
+    """
+    entry = json.loads(structured_log(action='test', id=VALUE['id'], created=VALUE['created'],
+                                      other=object))
+    assert entry['id'] == str(VALUE['id'])
+    assert entry['created'] == '2020-01-02T03:04:05.006789Z'
+    assert entry['other'] == str(object)
+
+
+def test_response_body(test_client):
+    """
+    Responses are written by the JSON encoder
+    """
+    ds1, _, _, _, _ = test_client
+    response = app.app.test_client().get('/v2/datasets/' + ds1['id'], headers={'Authorization': 'reader'})
+    assert response.status_code == 200
+    assert response.data.decode('utf-8').rstrip('\n') == serialization.dumps(response.json)
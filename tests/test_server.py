@@ -0,0 +1,44 @@
+"""
+Test suite for the ASGI server mode
+"""
+
+import os
+import sys
+import time
+import asyncio
+import pytest
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service.__main__ import asgi_application
+from tests.test_operations import load_test_client  # pylint: disable=unused-import
+
+pytest.importorskip('a2wsgi')
+httpx = pytest.importorskip('httpx')
+
+HEADERS = {'Authorization': 'reader'}
+
+
+def test_asgi_concurrent_requests(test_client):
+    """
+    A request waiting on the change feed does not hold up other requests
+    """
+    _, _, _, cl1, cl2 = test_client
+    transport = httpx.ASGITransport(app=asgi_application(threads=4))
+
+    async def timed_get(client, path):
+        response = await client.get(path, headers=HEADERS)
+        return response, time.monotonic()
+
+    async def requests():
+        async with httpx.AsyncClient(transport=transport, base_url='http://test/v2') as client:
+            return await asyncio.gather(
+                timed_get(client, '/datasets/changes?since=1000000&timeout=1'),
+                timed_get(client, '/datasets/getVersions'))
+
+    start = time.monotonic()
+    (poll, poll_done), (versions, versions_done) = asyncio.run(requests())
+    assert poll.json()['changes'] == []
+    assert versions.json() == [cl1['version'], cl2['version']]
+    assert versions_done - start < 0.5 < poll_done - start
@@ -0,0 +1,136 @@
+"""
+Test suite for request and response validation
+"""
+
+import os
+import sys
+import uuid
+import pytest
+import fastjsonschema
+
+from prometheus_client import REGISTRY
+
+sys.path.append("{}/{}".format(os.getcwd(), "candig_dataset_service"))
+sys.path.append(os.getcwd())
+
+from candig_dataset_service import orm
+from candig_dataset_service.__main__ import app
+from candig_dataset_service.orm.models import Dataset
+from candig_dataset_service.api.validation import compile_schema, to_json_schema
+from tests.test_operations import load_test_client  # pylint: disable=unused-import
+
+OPERATION = 'candig_dataset_service.api.operations.get_dataset_by_id'
+
+
+@pytest.fixture(name='bad_dataset_url')
+def load_bad_dataset_url(test_client):
+    """
+    URL of a dataset whose stored tags do not match the dataset schema
+    """
+    _, _, context, _, _ = test_client
+    dataset_id = uuid.uuid4().hex
+    with context:
+        db_session = orm.get_session()
+        db_session.add(Dataset(id=dataset_id, name='bad', tags=[1, 2]))
+        db_session.commit()
+    return '/v2/datasets/' + dataset_id
+
+
+def violations():
+    return REGISTRY.get_sample_value('dataset_service_response_validation_failures_total',
+                                     {'operation': OPERATION, 'status': '200'}) or 0
+
+
+def get(url):
+    return app.app.test_client().get(url, headers={'Authorization': 'key'})
+
+
+def test_always(bad_dataset_url, monkeypatch):
+    """
+    always: a non-conforming response becomes a 500
+    """
+    monkeypatch.setitem(app.app.config, 'RESPONSE_VALIDATION', 'always')
+
+    assert get(bad_dataset_url).status_code == 500
+
+
+@pytest.mark.parametrize('mode, rate, counted', [('sampled', 100, 1), ('sampled', 0, 0),
+                                                 ('off', 100, 0)])
+def test_sampled_and_off(bad_dataset_url, monkeypatch, mode, rate, counted):
+    """
+    sampled and off: the response is sent, sampled violations are counted
+    """
+    monkeypatch.setitem(app.app.config, 'RESPONSE_VALIDATION', mode)
+    monkeypatch.setitem(app.app.config, 'RESPONSE_VALIDATION_SAMPLE', rate)
+    before = violations()
+
+    response = get(bad_dataset_url)
+    assert response.status_code == 200
+    assert response.get_json()['tags'] == [1, 2]
+    assert violations() - before == counted
+
+
+def test_sampled_conforming(test_client, monkeypatch):
+    """
+    sampled: a conforming response, with its ETag and Cache-Control
+    headers, is not counted as a violation
+    """
+    dataset_1, _, _, _, _ = test_client
+    monkeypatch.setitem(app.app.config, 'RESPONSE_VALIDATION', 'sampled')
+    monkeypatch.setitem(app.app.config, 'RESPONSE_VALIDATION_SAMPLE', 100)
+    before = violations()
+
+    response = get('/v2/datasets/' + dataset_1['id'])
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    assert violations() == before
+
+
+def test_to_json_schema():
+    """
+    nullable and OpenAPI-only keywords are translated
+    """
+    schema = {'type': 'object', 'additionalProperties': False, 'xml': {'name': 'patch'},
+              'properties': {'name': {'type': 'string', 'example': 'x'},
+                             'tags': {'type': 'array', 'nullable': True,
+                                      'items': {'type': 'string'}}}}
+
+    assert to_json_schema(schema) == {
+        'type': 'object', 'additionalProperties': False,
+        'properties': {'name': {'type': 'string'},
+                       'tags': {'type': ['array', 'null'], 'items': {'type': 'string'}}}}
+    with pytest.raises(ValueError):
+        to_json_schema({'type': 'object', 'properties': {'id': {'type': 'string', 'readOnly': True}}})
+
+
+def test_compile_schema():
+    """
+    Compiled validators check types, nullable fields and uuids
+    """
+
+    validate = compile_schema({'type': 'object',
+                               'properties': {'id': {'type': 'string', 'format': 'uuid'},
+                                              'tags': {'type': 'array', 'nullable': True}}})
+    validate({'id': uuid.uuid4().hex, 'tags': None})
+    for body in ({'id': 'abc'}, {'tags': 'x'}):
+        with pytest.raises(fastjsonschema.JsonSchemaException):
+            validate(body)
+
+
+def test_post_dataset_invalid_body(test_client):
+    """
+    Invalid bodies are rejected with jsonschema's messages
+    """
+    client = app.app.test_client()
+    headers = {'Authorization': 'key'}
+
+    response = client.post('/v2/datasets', json={'name': 'bad', 'id': 'abc'}, headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == "'abc' is not a 'uuid' - 'id'"
+
+    response = client.post('/v2/datasets', json={'name': 'bad', 'tags': 'x'}, headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == "'x' is not of type 'array' - 'tags'"
+
+    response = client.post('/v2/datasets', json={'name': 'good', 'tags': ['x']}, headers=headers)
+    assert response.status_code == 201
@@ -1,4 +1,36 @@
-from candig_dataset_service.__main__ import application
+"""
+uwsgi entry point
+
+uwsgi loads this module once in the master and then forks the workers
+(lazy-apps is off), so the app and the DUO ontology are shared by the
+workers copy-on-write. Service options are read from the
+DATASET_SERVICE_ARGS environment variable, e.g.
+``--database ./data/datasets.db --pool-size 4``.
+"""
+
+import gc
+import os
+import shlex
+
+import candig_dataset_service.orm
+from candig_dataset_service.__main__ import application, main
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:  # not running under uwsgi
+    postfork = None
+
+main(shlex.split(os.environ.get('DATASET_SERVICE_ARGS', '')))
+
+if postfork is not None:
+    # workers must not inherit the master's connections: close them now,
+    # and have each worker open its own pool as soon as it is forked
+    candig_dataset_service.orm.dispose_engines()
+    postfork(candig_dataset_service.orm.prewarm_pools)
+
+    # keep the garbage collector from writing to the objects loaded so
+    # far, which would un-share their memory pages in every worker
+    gc.freeze()
 
 if __name__ == "__main__":
     application.run()